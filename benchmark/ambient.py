@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#
+# This file is part of photoframe (https://github.com/mrworf/photoframe).
+#
+# photoframe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# photoframe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with photoframe.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Replays a trace of color sensor readings through colormatch and
+# timekeeper, showing when the display would turn off and on and how
+# often the photo would be tinted again. Run it from the photoframe
+# folder:
+#
+#   python benchmark/ambient.py TRACE [--lux-limit L --lux-timeout M]
+#
+# A trace can be recorded on a frame with a TCS34725 (stop photoframe
+# first, it owns the sensor):
+#
+#   python benchmark/ambient.py --record TRACE [--duration S]
+#
+# or a made up day can be created with:
+#
+#   python benchmark/ambient.py --synthesize TRACE
+#
+import os
+import sys
+import math
+import time
+import random
+import argparse
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from modules.sensor import tcs34725, replay
+from modules.colormatch import colormatch
+from modules.timekeeper import timekeeper
+from modules.whitebalance import whitebalance
+from modules.slideshow import slideshow
+
+def record(filename, duration):
+  device = tcs34725()
+  if not device.open():
+    print('No sensor found')
+    sys.exit(1)
+  start = time.time()
+  with open(filename, 'w') as f:
+    f.write('# seconds,red,green,blue,clear\n')
+    while duration is None or time.time() - start < duration:
+      f.write('%.1f,%d,%d,%d,%d\n' % ((time.time() - start,) + device.read()))
+      f.flush()
+      time.sleep(1)
+
+def rgbc(temperature, lux):
+  # Raw readings colormatch would turn into temperature and lux, found
+  # by searching the black body colors
+  if lux <= 0:
+    return (0, 0, 0, 0)
+  low, high = 1000.0, 40000.0
+  for i in range(40):
+    middle = (low + high) / 2
+    color = whitebalance._kelvinToRGB(middle)
+    if colormatch._temperature_and_lux(color + [sum(color)])[0] < temperature:
+      low = middle
+    else:
+      high = middle
+  color = whitebalance._kelvinToRGB(low)
+  scale = lux / colormatch._temperature_and_lux(color + [sum(color)])[1]
+  return tuple([int(x * scale) for x in color] + [int(sum(color) * scale)])
+
+def synthesize(filename):
+  # Daylight from 6 to 20, a warm lamp in the evening and darkness at
+  # night. Every reading is noisy and a few are way off.
+  random.seed(42)
+  with open(filename, 'w') as f:
+    f.write('# seconds,red,green,blue,clear\n')
+    for second in range(0, 24 * 3600, 2):
+      hour = second / 3600.0
+      daylight = max(0.0, math.sin((hour - 6) / 14 * math.pi)) * 300 if 6 <= hour <= 20 else 0.0
+      lamp = 60.0 if 18 <= hour < 23 else 0.0
+      lux = daylight + lamp
+      temperature = 6000 if lamp == 0 else (6000 * daylight + 2700 * lamp) / max(lux, 1)
+      if lux > 0:
+        lux *= random.gauss(1, 0.03)
+        temperature += random.gauss(0, 40)
+        if random.random() < 0.01:
+          lux *= 4
+      f.write('%d,%d,%d,%d,%d\n' % ((second,) + rgbc(temperature, lux)))
+
+def simulate(filename, speed, luxLimit, luxTimeout):
+  device = replay(filename, speed)
+  start = time.time()
+  events = []
+  def stamp():
+    return time.strftime('%H:%M:%S', time.gmtime(device.time()))
+
+  def power(on):
+    events.append('%s display %s' % (stamp(), 'on' if on else 'off'))
+
+  # timekeeper is driven by the simulated clock rather than its own thread
+  keeper = timekeeper(power, lambda: None, device)
+  keeper.setAmbientSensitivity(luxLimit, luxTimeout)
+  keeper.setPowermode('sensor')
+  device.addClockListener(keeper.evaluateAmbient)
+
+  matcher = colormatch(2700, None, device)
+  counts = {'notified' : 0, 'retint' : 0}
+  tint = {'temperature' : None}
+  def changed(temperature, lux):
+    # Same rule as slideshow uses for the photo on screen
+    counts['notified'] += 1
+    bucket = matcher.getTemperatureBucket()
+    current = tint['temperature']
+    if bucket == current:
+      return
+    if bucket is not None and current is not None and abs(bucket - current) < slideshow.HYSTERESIS:
+      return
+    tint['temperature'] = bucket
+    counts['retint'] += 1
+  matcher.addUpdateListener(changed)
+  matcher.addUpdateListener(keeper.sensorListener)
+
+  # Count readings by counting sleeps
+  readings = {'count' : 0}
+  device.addClockListener(lambda: readings.update(count=readings['count'] + 1))
+  matcher.join()
+
+  for event in events:
+    print(event)
+  simulated = device.time() - device.readings[0][0]
+  print('Simulated %.1f hours in %.1fs' % (simulated / 3600.0, time.time() - start))
+  print('%d sensor readings (%d at one per second), %d notifications, %d re-tints' % (readings['count'], simulated, counts['notified'], counts['retint']))
+
+parser = argparse.ArgumentParser(description='Simulate ambient light handling from a sensor trace')
+parser.add_argument('trace', help='File with readings')
+parser.add_argument('--record', action='store_true', help='Record a trace from the sensor instead')
+parser.add_argument('--duration', type=int, help='Seconds to record, until interrupted if not given')
+parser.add_argument('--synthesize', action='store_true', help='Make up a day long trace instead')
+parser.add_argument('--speed', type=float, help='Replay this many times faster than real time, as fast as possible if not given')
+parser.add_argument('--lux-limit', default=10, type=float, help='Turn display off below this many lux')
+parser.add_argument('--lux-timeout', default=5, type=float, help='Minutes below (or above) the limit before acting')
+cmdline = parser.parse_args()
+logging.basicConfig(level=logging.WARNING)
+
+if cmdline.record:
+  record(cmdline.trace, cmdline.duration)
+elif cmdline.synthesize:
+  synthesize(cmdline.trace)
+else:
+  simulate(cmdline.trace, cmdline.speed, cmdline.lux_limit, cmdline.lux_timeout)
+  # timekeeper's thread never ends, don't wait for the interpreter to
+  # tear it down
+  sys.stdout.flush()
+  os._exit(0)
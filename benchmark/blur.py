@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+#
+# This file is part of photoframe (https://github.com/mrworf/photoframe).
+#
+# photoframe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# photoframe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with photoframe.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Compares ways of making the blurred background for imagesizing=blur:
+# the original full resolution convert command, a full resolution
+# gaussian in Pillow and the downscaled blur. Run it from the photoframe
+# folder:
+#
+#   python benchmark/blur.py [--rounds N] [--width W --height H]
+#
+# Besides the time, the mean difference (in levels out of 255) from the
+# full resolution result is shown to confirm they look the same.
+#
+import os
+import sys
+import time
+import argparse
+import tempfile
+import shutil
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from modules.blur import blur
+from modules.renderer import renderer
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+SOURCES = {
+  '1080p' : (1920, 1080),
+  '4K' : (3840, 2160),
+}
+
+def makeSource(folder, name, size):
+  # Shapes and edges, which is where a poor blur would show
+  from PIL import Image, ImageDraw
+  image = Image.new('RGB', size)
+  draw = ImageDraw.Draw(image)
+  for y in range(0, size[1], 4):
+    draw.line([(0, y), (size[0], y)], fill=(y % 256, (y * 3) % 256, (y * 7) % 256), width=2)
+  step = size[0] // 12
+  for x in range(0, size[0], step):
+    draw.rectangle([x, size[1] // 4, x + step // 2, size[1] * 3 // 4], fill=(255 - x % 256, x % 256, 128))
+  filename = os.path.join(folder, '%s.jpg' % name)
+  image.save(filename, quality=90)
+  return filename
+
+def hasImageMagick():
+  try:
+    with open(os.devnull, 'wb') as void:
+      subprocess.check_call(['convert', '-version'], stdout=void, stderr=void)
+    return True
+  except:
+    return False
+
+def convert(filename, output, width, height):
+  # The background part of helper.makeFullframe before the blur engine
+  subprocess.check_call([
+    'convert',
+    filename + '[0]',
+    '-resize',
+    '%sx%s^' % (width, height),
+    '-gravity',
+    'center',
+    '-crop',
+    '%sx%s+0+0' % (width, height),
+    '+repage',
+    '-blur',
+    '0x12',
+    '-brightness-contrast',
+    '-20x0',
+    output
+  ])
+  return renderer.load(output)
+
+def gaussian(image, width, height):
+  # What the Pillow renderer did before the blur engine
+  from PIL import ImageFilter, ImageEnhance
+  result = renderer.cover(image, width, height).filter(ImageFilter.GaussianBlur(12))
+  return ImageEnhance.Brightness(result).enhance(0.8)
+
+def measure(func, rounds):
+  durations = []
+  result = None
+  for i in range(rounds):
+    start = time.time()
+    result = func()
+    durations.append(time.time() - start)
+  return sorted(durations)[len(durations) // 2], result
+
+def difference(a, b):
+  if numpy is None:
+    return None
+  a = numpy.asarray(a, dtype=numpy.int16)
+  b = numpy.asarray(b, dtype=numpy.int16)
+  return numpy.abs(a - b).mean()
+
+parser = argparse.ArgumentParser(description='Benchmark the background blur')
+parser.add_argument('--rounds', default=5, type=int, help='How many backgrounds to make per test')
+parser.add_argument('--width', default=1920, type=int, help='Width of display')
+parser.add_argument('--height', default=1080, type=int, help='Height of display')
+cmdline = parser.parse_args()
+
+if not blur.available():
+  print('Pillow is not installed, cannot benchmark')
+  sys.exit(1)
+
+magick = hasImageMagick()
+if not magick:
+  print('ImageMagick is not installed, comparing against Pillow only')
+
+folder = tempfile.mkdtemp()
+try:
+  print('Display is %dx%d, median of %d rounds' % (cmdline.width, cmdline.height, cmdline.rounds))
+  for name in sorted(SOURCES):
+    filename = makeSource(folder, name, SOURCES[name])
+    image = renderer.load(filename)
+    width, height = cmdline.width, cmdline.height
+
+    tests = []
+    if magick:
+      output = os.path.join(folder, 'output.png')
+      tests.append(('convert', lambda: convert(filename, output, width, height)))
+    tests.append(('gaussian', lambda: gaussian(image, width, height)))
+    tests.append(('downscaled', lambda: blur.background(image, width, height)))
+
+    results = []
+    for test, func in tests:
+      results.append((test,) + measure(func, cmdline.rounds))
+
+    reference = results[0]
+    print('%s source:' % name)
+    for test, duration, result in results:
+      line = '  %-10s %7.3fs' % (test, duration)
+      if test != reference[0]:
+        line += '  %5.1fx faster' % (reference[1] / max(duration, 0.0001))
+        diff = difference(reference[2], result)
+        if diff is not None:
+          line += ', differs by %.1f levels' % diff
+      print(line)
+finally:
+  shutil.rmtree(folder)
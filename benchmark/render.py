@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+#
+# This file is part of photoframe (https://github.com/mrworf/photoframe).
+#
+# photoframe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# photoframe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with photoframe.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Compares the ImageMagick and Pillow renderers by preparing frames from
+# 1080p and 4K sources, run it from the photoframe folder:
+#
+#   python benchmark/render.py [--rounds N] [--width W --height H --depth D]
+#
+import os
+import sys
+import time
+import argparse
+import tempfile
+import shutil
+import logging
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from modules.display import display
+from modules.renderer import renderer
+
+SOURCES = {
+  '1080p' : (1920, 1080),
+  '4K' : (3840, 2160),
+}
+
+def makeSource(folder, name, size):
+  # A gradient with some detail so the JPEG isn't trivial to decode
+  from PIL import Image, ImageDraw
+  image = Image.new('RGB', size)
+  draw = ImageDraw.Draw(image)
+  for y in range(0, size[1], 4):
+    draw.line([(0, y), (size[0], y)], fill=(y % 256, (y * 3) % 256, (y * 7) % 256), width=2)
+  for x in range(0, size[0], 16):
+    draw.line([(x, 0), (size[0] - x, size[1])], fill=(255 - x % 256, x % 256, 128))
+  filename = os.path.join(folder, '%s.jpg' % name)
+  image.save(filename, quality=90)
+  return filename
+
+def hasImageMagick():
+  try:
+    with open(os.devnull, 'wb') as void:
+      subprocess.check_call(['convert', '-version'], stdout=void, stderr=void)
+    return True
+  except:
+    return False
+
+def makeDisplay(width, height, depth):
+  # Frames are only prepared, never shown, so no framebuffer is needed.
+  # The emulator isn't used since it always renders 32bit.
+  disp = display()
+  disp.enabled = True
+  disp.width = width
+  disp.height = height
+  disp.depth = depth
+  if depth == 16:
+    disp.format = 'rgb'
+  else:
+    disp.format = 'bgra' if depth == 32 else 'bgr'
+  return disp
+
+def measure(disp, filename, rounds):
+  durations = []
+  for i in range(rounds):
+    start = time.time()
+    frame = disp.prepare(filename)
+    durations.append(time.time() - start)
+    if frame is None:
+      return None
+  return sorted(durations)[len(durations) // 2]
+
+parser = argparse.ArgumentParser(description='Benchmark the frame renderers')
+parser.add_argument('--rounds', default=5, type=int, help='How many frames to render per test')
+parser.add_argument('--width', default=1920, type=int, help='Width of display')
+parser.add_argument('--height', default=1080, type=int, help='Height of display')
+parser.add_argument('--depth', default=32, type=int, choices=[16, 24, 32], help='Depth of display')
+cmdline = parser.parse_args()
+logging.basicConfig(level=logging.ERROR)
+
+if not renderer.available():
+  print('Pillow is not installed, nothing to compare with')
+  sys.exit(1)
+
+backends = ['pillow']
+if hasImageMagick():
+  backends.insert(0, 'imagemagick')
+else:
+  print('ImageMagick is not installed, only measuring Pillow')
+
+folder = tempfile.mkdtemp()
+try:
+  disp = makeDisplay(cmdline.width, cmdline.height, cmdline.depth)
+  print('Display is %dx%d, %dbit, median of %d rounds' % (cmdline.width, cmdline.height, cmdline.depth, cmdline.rounds))
+  for name in sorted(SOURCES):
+    filename = makeSource(folder, name, SOURCES[name])
+    results = {}
+    for backend in backends:
+      disp.setRenderer(backend)
+      results[backend] = measure(disp, filename, cmdline.rounds)
+    line = '%-6s' % name
+    for backend in backends:
+      if results[backend] is None:
+        line += '  %s: failed' % backend
+      else:
+        line += '  %s: %6.3fs' % (backend, results[backend])
+    if 'imagemagick' in results and results['imagemagick'] and results['pillow']:
+      line += '  (%.1fx)' % (results['imagemagick'] / results['pillow'])
+    print(line)
+finally:
+  shutil.rmtree(folder)
@@ -41,6 +41,8 @@ from modules.oauth import OAuth
 from modules.slideshow import slideshow
 from modules.colormatch import colormatch
 from modules.drivers import drivers
+from modules.framecache import framecache
+from modules.overlay import overlay
 
 from modules.servicemanager import ServiceManager
 
@@ -233,12 +235,23 @@ def cfg_keyvalue(key, value):
     settings.setUser(key, value)
 
     if key in ['orientation']:
-      display.rotate(value)
+      # Portrait means the display is turned, photos are picked to match
+      if value == 'portrait':
+        settings.setUser('rotation', 90)
+      elif value == 'landscape':
+        settings.setUser('rotation', 0)
+    if key in ['orientation', 'rotation']:
+      display.setRotation(settings.getUser('rotation'))
+      width, height = display.getSize()
+      settings.setUser('width',  width)
+      settings.setUser('height', height)
+      slideshow.trigger()
     if key in ['display-driver']:
       drv = settings.getUser('display-driver')
       if drv == 'none':
         drv = None
       special = drivers.activate(drv)
+      display.invalidate()
       if special is None:
         settings.setUser('display-driver', 'none')
         settings.setUser('display-special', None)
@@ -255,12 +268,26 @@ def cfg_keyvalue(key, value):
       settings.setUser('width',  width)
       settings.setUser('height', height)
       display.enable(True, True)
+      # Anything already prepared was made for the old resolution
+      slideshow.trigger()
     if key in ['display-on', 'display-off']:
       timekeeper.setConfiguration(settings.getUser('display-on'), settings.getUser('display-off'))
     if key in ['autooff-lux', 'autooff-time']:
       timekeeper.setAmbientSensitivity(settings.getUser('autooff-lux'), settings.getUser('autooff-time'))
     if key in ['powersave']:
       timekeeper.setPowermode(settings.getUser('powersave'))
+    if key in ['renderer']:
+      display.setRenderer(settings.getUser('renderer'))
+      slideshow.trigger()
+    if key in ['dither']:
+      display.setDither(settings.getUser('dither'))
+      slideshow.trigger()
+    if key in ['transition', 'transition-duration', 'transition-fps']:
+      display.setTransition(settings.getUser('transition'), settings.getUser('transition-duration'), settings.getUser('transition-fps'))
+    if key in ['overlay-clock']:
+      overlay.setClock(settings.getUser('overlay-clock'))
+    if key in ['cache-size']:
+      framecache.setBudget(settings.getUser('cache-size'))
     if key in ['shutdown-pin']:
       powermanagement.stopmonitor()
       powermanagement = shutdown(settings.getUser('shutdown-pin'))
@@ -336,18 +363,43 @@ def cfg_reset(cmd):
     else:
       return 'Cannot find update tool', 404
 
+@app.route('/details/color/history')
+@auth.login_required
+def cfg_details_color_history():
+  # Sensor readings, resolution is in seconds (0 for every reading in
+  # the last hour) and since/until limit the period (seconds since epoch)
+  resolution = request.args.get('resolution', 60, type=int)
+  since = request.args.get('since', None, type=float)
+  until = request.args.get('until', None, type=float)
+  result = colormatch.getHistory(resolution, since, until)
+  if result is None:
+    abort(404)
+  return jsonify(result)
+
 @app.route('/details/<about>')
 @auth.login_required
 def cfg_details(about):
   if about == 'tvservice':
     result = {}
-    result['resolution'] = display.available()
+    # Someone is looking, so make sure the list is current (new monitor?)
+    result['resolution'] = display.available(refresh=True)
     result['status'] = display.current()
     return jsonify(result)
   elif about == 'current':
-    image, mime = display.get()
-    response = app.make_response(image)
-    response.headers.set('Content-Type', mime)
+    # The screen is only encoded when it has changed, browsers which
+    # already have the current one get a 304 (w= gives a thumbnail)
+    width = request.args.get('w', None, type=int)
+    tag = display.getSnapshotTag(width)
+    if request.method == 'HEAD' or tag in request.if_none_match:
+      response = app.make_response('')
+      if request.method != 'HEAD':
+        response.status_code = 304
+    else:
+      image, mime, tag = display.getSnapshot(width)
+      response = app.make_response(image)
+      response.headers.set('Content-Type', mime)
+    response.set_etag(tag)
+    response.headers.set('Cache-Control', 'no-cache')
     return response
   elif about == 'drivers':
     result = drivers.list().keys()
@@ -366,6 +418,8 @@ def cfg_details(about):
     return jsonify({'date':infoDate, 'commit':infoCommit, 'branch': infoBranch})
   elif about == 'color':
     return jsonify(slideshow.getColorInformation())
+  elif about == 'timing':
+    return jsonify(slideshow.getTimingInformation())
   elif about == 'sensor':
     return jsonify({'sensor' : colormatch.hasSensor()})
   elif about == 'display':
@@ -525,6 +579,10 @@ if settings.getUser('timezone') == '':
   settings.setUser('timezone', helper.timezoneCurrent())
   settings.save()
 
+display.setRenderer(settings.getUser('renderer'))
+display.setDither(settings.getUser('dither'))
+display.setTransition(settings.getUser('transition'), settings.getUser('transition-duration'), settings.getUser('transition-fps'))
+display.setRotation(settings.getUser('rotation'))
 width, height, tvservice = display.setConfiguration(settings.getUser('tvservice'), settings.getUser('display-special'))
 settings.setUser('tvservice', tvservice)
 settings.setUser('width',  width)
@@ -553,16 +611,22 @@ display.setConfigPage('http://%s:%d/' % (settings.get('local-ip'), 7777))
 
 # Prep random
 random.seed(long(time.clock()))
-colormatch = colormatch(settings.get('colortemp-script'), 2700) # 2700K = Soft white, lowest we'll go
+colormatch = colormatch(2700) # 2700K = Soft white, lowest we'll go
+framecache = framecache(os.path.join(settings.CONFIGFOLDER, 'cache'), settings.getUser('cache-size'))
 slideshow = slideshow(display, settings, colormatch)
 timekeeper = timekeeper(display.enable, slideshow.start)
 slideshow.setQueryPower(timekeeper.getDisplayOn)
 slideshow.setServiceManager(services)
+slideshow.setFrameCache(framecache)
+overlay = overlay(display)
+display.setOverlay(overlay)
+slideshow.setOverlay(overlay)
+overlay.setClock(settings.getUser('overlay-clock'))
 
 timekeeper.setConfiguration(settings.getUser('display-on'), settings.getUser('display-off'))
 timekeeper.setAmbientSensitivity(settings.getUser('autooff-lux'), settings.getUser('autooff-time'))
 timekeeper.setPowermode(settings.getUser('powersave'))
-colormatch.setUpdateListener(timekeeper.sensorListener)
+colormatch.addUpdateListener(timekeeper.sensorListener)
 
 powermanagement = shutdown(settings.getUser('shutdown-pin'))
 
@@ -0,0 +1,106 @@
+# This file is part of photoframe (https://github.com/mrworf/photoframe).
+#
+# photoframe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# photoframe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with photoframe.  If not, see <http://www.gnu.org/licenses/>.
+#
+import math
+
+try:
+  from PIL import Image, ImageFilter, ImageEnhance
+except ImportError:
+  Image = None
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# Creates the blurred background used by imagesizing=blur. A blur this
+# strong removes all detail anyway, so rather than blurring at display
+# resolution the covering crop is scaled straight down to a fraction of
+# the screen, blurred there with a few passes of a box blur (which is
+# close to a gaussian) and scaled back up. The result looks the same
+# while touching only a few percent of the pixels.
+class blur:
+  # How much smaller than the screen the blur is done
+  FACTOR = 8
+
+  # Box blur passes, three is within a few percent of a true gaussian
+  PASSES = 3
+
+  @staticmethod
+  def available():
+    return Image is not None
+
+  @staticmethod
+  def _coverBox(size, width, height):
+    # Area of size which covers width x height once scaled, centered
+    scale = max(float(width) / size[0], float(height) / size[1])
+    w, h = width / scale, height / scale
+    left, top = (size[0] - w) / 2, (size[1] - h) / 2
+    return (int(left), int(top), int(round(left + w)), int(round(top + h)))
+
+  @staticmethod
+  def _boxRadius(sigma, passes):
+    # Box width giving the same variance as sigma after all passes
+    width = math.sqrt(12.0 * sigma * sigma / passes + 1)
+    return max(0, int(round((width - 1) / 2)))
+
+  @staticmethod
+  def _box(pixels, radius, axis):
+    # Moving average over 2 * radius + 1 pixels, edges are repeated
+    # just like ImageMagick's default virtual pixels
+    pad = [(0, 0)] * pixels.ndim
+    pad[axis] = (radius + 1, radius)
+    total = numpy.cumsum(numpy.pad(pixels, pad, mode='edge'), axis=axis)
+    size = pixels.shape[axis]
+    window = 2 * radius + 1
+    upper = numpy.take(total, range(window, window + size), axis=axis)
+    lower = numpy.take(total, range(0, size), axis=axis)
+    return (upper - lower) / window
+
+  @staticmethod
+  def _reduce(image, size, box):
+    # Scales the box of image down to size. Pillow 7 can first shrink by
+    # an integer factor which is a lot faster for a large reduction.
+    try:
+      return image.resize(size, Image.BILINEAR, box, reducing_gap=2.0)
+    except TypeError:
+      pass
+    try:
+      return image.resize(size, Image.BILINEAR, box)
+    except TypeError:
+      # Pillow before 4.3 can't resample a region directly
+      return image.crop(box).resize(size, Image.BILINEAR)
+
+  @staticmethod
+  def background(image, width, height, sigma=12, brightness=0.8):
+    # Same as -resize WxH^ -gravity center -crop WxH+0+0 -blur 0xSIGMA
+    # followed by darkening to brightness, for an RGB image
+    small = (max(1, width // blur.FACTOR), max(1, height // blur.FACTOR))
+    box = blur._coverBox(image.size, width, height)
+    reduced = blur._reduce(image, small, box)
+    scaled = float(sigma) * small[0] / width
+
+    if numpy is not None:
+      pixels = numpy.asarray(reduced, dtype=numpy.float32)
+      radius = blur._boxRadius(scaled, blur.PASSES)
+      for i in range(blur.PASSES):
+        pixels = blur._box(pixels, radius, 0)
+        pixels = blur._box(pixels, radius, 1)
+      pixels = numpy.clip(pixels * brightness + 0.5, 0, 255).astype(numpy.uint8)
+      reduced = Image.fromarray(pixels, 'RGB')
+    else:
+      reduced = reduced.filter(ImageFilter.GaussianBlur(scaled))
+      reduced = ImageEnhance.Brightness(reduced).enhance(brightness)
+    return reduced.resize((width, height), Image.BILINEAR)
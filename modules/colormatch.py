@@ -14,29 +14,47 @@
 # along with photoframe.  If not, see <http://www.gnu.org/licenses/>.
 #
 from threading import Thread
-import smbus
-import time
-import os
-import subprocess
 import logging
 
+from modules.smoothing import smoothing
+from modules.sensor import tcs34725
+from modules.history import history
+
+# Tracks the ambient light using a sensor, a TCS34725 unless another is
+# given (see modules/sensor.py). Images are adjusted
+# to match by whitebalance, using the temperature from
+# getTemperatureBucket().
+#
+# Readings are filtered, and the sensor is read often only while the
+# light is changing. Listeners are only told about changes that matter.
 class colormatch(Thread):
-	def __init__(self, script, min = None, max = None):
+	BUCKET = 100 # Kelvin per step when quantising the temperature
+	FAST = 1 # Seconds between readings while the light is changing
+	SLOW = 30 # Longest time between readings while it's stable
+	CHANGE_TEMPERATURE = 50 # Kelvin needed before telling listeners
+	CHANGE_LUX = 0.1 # Part of lux needed before telling listeners
+	MIN_LUX = 1.0 # Smallest change in lux which counts
+	MIN_CLEAR = 50 # Below this count the temperature is mostly noise
+
+	def __init__(self, min = None, max = None, device = None):
 		Thread.__init__(self)
 		self.daemon = True
+		self.device = device
+		if self.device is None:
+			self.device = tcs34725()
 		self.sensor = False
 		self.temperature = None
 		self.lux = None
-		self.script = script
-		self.void = open(os.devnull, 'wb')
 		self.min = min
 		self.max = max
-		self.listener = None
+		self.listeners = []
 		self.allowAdjust = False
-		if self.script is not None and self.script != '':
-			self.hasScript = os.path.exists(self.script)
-		else:
-			self.hasScript = False
+		self.filterTemperature = smoothing()
+		self.filterLux = smoothing()
+		self.previous = None
+		self.notified = None
+		self.interval = colormatch.FAST
+		self.history = history()
 
 		self.start()
 
@@ -59,36 +77,74 @@ class colormatch(Thread):
 	def getLux(self):
 		return self.lux
 
-	def setUpdateListener(self, listener):
-		self.listener = listener
-
-	def adjust(self, filename, temperature = None):
-		if not self.allowAdjust or not self.hasScript:
-			return False
-
-		if self.temperature is None or self.sensor is None:
-			logging.debug('Temperature is %s and sensor is %s', repr(self.temperature), repr(self.sensor))
-			return False
-		if temperature is None:
-			temperature = self.temperature
+	def getHistory(self, resolution, since = None, until = None):
+		# Filtered readings at one of history.LEVELS, None if there is no
+		# such resolution
+		return self.history.get(resolution, since, until)
+
+	def addUpdateListener(self, listener):
+		# listener(temperature, lux) is called with the filtered values on
+		# the first reading and then only when the temperature has moved by
+		# CHANGE_TEMPERATURE or lux by CHANGE_LUX (at least MIN_LUX) since
+		# listeners were last called. Steady light means no calls at all.
+		self.listeners.append(listener)
+
+	def getTemperatureBucket(self):
+		# Returns the quantised temperature images should be adjusted to,
+		# limited to min and max, so images adjusted for similar conditions
+		# can be reused. None means that images won't be adjusted at all.
+		if not self.sensor or not self.allowAdjust or self.temperature is None:
+			return None
+		temperature = self.temperature
 		if self.min is not None and temperature < self.min:
-			logging.debug('Actual color temp measured is %d, but we cap to %dK' % (temperature, self.min))
 			temperature = self.min
 		elif self.max is not None and temperature > self.max:
-			logging.debug('Actual color temp measured is %d, but we cap to %dK' % (temperature, self.max))
 			temperature = self.max
+		return int(round(float(temperature) / colormatch.BUCKET) * colormatch.BUCKET)
+
+	def _differs(self, old, new, scale = 1.0):
+		# True if the (temperature, lux) readings differ enough, scale
+		# lowers the bar
+		if old is None:
+			return True
+		if old[0] is None or new[0] is None:
+			if old[0] != new[0]:
+				return True
+		elif abs(new[0] - old[0]) >= colormatch.CHANGE_TEMPERATURE * scale:
+			return True
+		return abs(new[1] - old[1]) >= max(colormatch.MIN_LUX, colormatch.CHANGE_LUX * old[1]) * scale
+
+	def _sample(self, temperature, lux):
+		# Filters a reading and tells listeners if it has changed enough.
+		# Returns seconds until the next reading, which grows while the
+		# light is stable. Temperature is None when it's too dark to tell,
+		# in which case we keep the one we had.
+		#
+		# The filters take a few readings to follow a change, so a raw
+		# reading which differs from them is followed up right away rather
+		# than after another slow interval. It's up to the filters to tell
+		# if the change lasts.
+		raw = (self.temperature if temperature is None else temperature, lux)
+		changing = self._differs(self.previous, raw)
+		if temperature is not None:
+			self.temperature = self.filterTemperature.add(temperature)
+		self.lux = self.filterLux.add(lux)
+		self.history.add(self.device.time(), self.temperature, self.lux)
+		current = (self.temperature, self.lux)
+
+		if self._differs(self.previous, current, 0.25):
+			self.interval = colormatch.FAST
 		else:
-			logging.debug('Adjusting color temperature to %dK' % temperature)
-
-		try:
-			result = subprocess.call([self.script, '-t', "%d" % temperature, filename + '[0]', filename + '.jpg'], stderr=self.void) == 0
-			if result:
-				os.unlink(filename)
-				os.rename(filename + '.jpg', filename)
-			return result
-		except:
-			logging.exception('Unable to run %s:', self.script)
-			return False
+			self.interval = min(colormatch.SLOW, self.interval * 2)
+		self.previous = current
+
+		if self._differs(self.notified, current):
+			self.notified = current
+			for listener in self.listeners:
+				listener(self.temperature, self.lux)
+		if changing:
+			return colormatch.FAST
+		return self.interval
 
 	# The following function (_temperature_and_lux) is lifted from the
 	# https://github.com/adafruit/Adafruit_CircuitPython_TCS34725 project and
@@ -116,7 +172,8 @@ class colormatch(Thread):
 	# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 	# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 	# THE SOFTWARE.
-	def _temperature_and_lux(self, data):
+	@staticmethod
+	def _temperature_and_lux(data):
 		"""Convert the 4-tuple of raw RGBC data to color temperature and lux values. Will return
 		   2-tuple of color temperature and lux."""
 		r, g, b, _ = data
@@ -129,56 +186,24 @@ class colormatch(Thread):
 		return cct, y
 	###################################################################################
 
-	# This function is mostly based of the example provided by Brad Berkland's blog:
-	# http://bradsrpi.blogspot.com/2013/05/tcs34725-rgb-color-sensor-raspberry-pi.html
-	#
 	def run(self):
-		try:
-			bus = smbus.SMBus(1)
-		except:
-			logging.info('No SMB subsystem, color sensor unavailable')
+		if not self.device.open():
 			return
-		# I2C address 0x29
-		# Register 0x12 has device ver.
-		# Register addresses must be OR'ed with 0x80
-		try:
-			bus.write_byte(0x29,0x80|0x12)
-		except:
-			logging.info('ColorSensor not available')
-			return
-		ver = bus.read_byte(0x29)
-		# version # should be 0x44
-		if ver == 0x44:
-			# Make sure we have the needed script
-			if not os.path.exists(self.script):
-				logging.info('No color temperature script, download it from http://www.fmwconcepts.com/imagemagick/colortemp/index.php and save as "%s"' % self.script)
-				self.allowAdjust = False
-			self.allowAdjust = True
-
-			bus.write_byte(0x29, 0x80|0x00) # 0x00 = ENABLE register
-			bus.write_byte(0x29, 0x01|0x02) # 0x01 = Power on, 0x02 RGB sensors enabled
-			bus.write_byte(0x29, 0x80|0x14) # Reading results start register 14, LSB then MSB
-			self.sensor = True
-			logging.debug('TCS34725 detected, starting polling loop')
-			while True:
-				data = bus.read_i2c_block_data(0x29, 0)
-				clear = clear = data[1] << 8 | data[0]
-				red = data[3] << 8 | data[2]
-				green = data[5] << 8 | data[4]
-				blue = data[7] << 8 | data[6]
-				if red > 0 and green > 0 and blue > 0 and clear > 0:
-					temp, lux = self._temperature_and_lux((red, green, blue, clear))
-					self.temperature = temp
-					self.lux = lux
-				else:
-					# All zero Happens when no light is available, so set temp to zero
-					self.temperature = 0
-					self.lux = 0
-
-				if self.listener:
-					self.listener(self.temperature, self.lux)
-
-				time.sleep(1)
-		else:
-			logging.info('No TCS34725 color sensor detected, will not compensate for ambient color temperature')
-			self.sensor = False
+		self.allowAdjust = True
+		self.sensor = True
+		logging.debug('%s detected, starting polling loop', self.device.name)
+		while True:
+			data = self.device.read()
+			if data is None:
+				logging.info('%s has no more readings', self.device.name)
+				break
+			red, green, blue, clear = data
+			if red > 0 and green > 0 and blue > 0 and clear > 0:
+				temp, lux = self._temperature_and_lux((red, green, blue, clear))
+				if clear < colormatch.MIN_CLEAR:
+					temp = None
+			else:
+				# All zero happens when no light is available
+				temp, lux = None, 0
+
+			self.device.sleep(self._sample(temp, lux))
@@ -19,7 +19,16 @@ import logging
 import time
 import re
 import json
-from threading import Thread
+import zlib
+from collections import OrderedDict
+from threading import Thread, Lock, RLock
+
+from modules.renderer import renderer
+from modules.framebuffer import framebuffer
+from modules.pixelformat import pixelformat
+from modules.transition import transition
+from modules.imageheader import imageheader
+from modules.helper import helper
 
 class emulator(Thread):
   def __init__(self, width, height, file):
@@ -36,9 +45,19 @@ class emulator(Thread):
       result = subprocess.check_output(args)
 
 class display:
+  # How many rendered messages to keep, enough for the startup countdown
+  MESSAGE_CACHE = 12
+
+  # Probed capabilities, shared by all instances, see _capabilities()
+  _caps = None
+  _capsKey = None
+  _capsLock = Lock()
+
   def isRotated(self):
     # TODO: This should be handled centrally
     rotate = False
+    if not os.path.exists('/boot/config.txt'):
+      return rotate
     with open('/boot/config.txt', 'r') as f:
       for line in f:
         clean = line.strip()
@@ -51,27 +70,17 @@ class display:
             rotate = False
     return rotate
 
-  def rotate(self, orientation):
-    if orientation == "both":
-      return
-    # TODO: This should be handled centrally
-    with open('/boot/config.txt', 'r') as f:
-      data = f.readlines()
-
-    done=False
-    with open("/boot/config.txt", "w") as f:
-      for line in data:
-        clean = line.strip()
-        if clean.startswith("display_rotate"):
-          if orientation == "portrait" and not done:
-            f.write("display_rotate=1\n")
-            done=True
-        else:
-          f.write(clean+"\n")
-
-      if not done and orientation == "portrait":
-        f.write("display_rotate=1")
-
+  def setRotation(self, rotation):
+    # Rotates everything shown clockwise by 0, 90, 180 or 270 degrees.
+    # It's done when frames are rendered, so it takes effect right away.
+    rotation = int(rotation) % 360
+    if rotation not in [0, 90, 180, 270]:
+      logging.warning('Cannot rotate %d degrees, only 0, 90, 180 or 270', rotation)
+      rotation = 0
+    if rotation and self.rotated:
+      logging.warning('Display is already rotated by display_rotate in /boot/config.txt, remove it to rotate in software')
+      rotation = 0
+    self.rotation = rotation
 
   def __init__(self, use_emulator=False):
     self.void = open(os.devnull, 'wb')
@@ -80,12 +89,100 @@ class display:
     self.emulate = use_emulator
     self.emulator = None
     self.rotated = self.isRotated()
+    self.rotation = 0
     self.xoffset = 0
     self.yoffset = 0
     self.url = None
+    self.usePillow = False
+    self.fb = None
+    # Device which couldn't be mapped, not tried again until closed
+    self.fbFailed = None
+    self.dither = False
+    self.transition = transition()
+    # Last full frame written and the layers drawn on top of it
+    self.base = None
+    self.overlay = None
+    self.writeLock = RLock()
+    # Encoded copies of what is on screen, keyed by width (0 = full size)
+    # and only valid for the snapshotVersion they were made for
+    self.snapshots = {}
+    self.snapshotVersion = 0
+    self.snapshotEpoch = int(time.time())
+    self.snapshotLock = Lock()
+    # Rendered messages, compressed since they're mostly black
+    self.messages = OrderedDict()
+    self.messageLock = Lock()
     if self.emulate:
       logging.info('Using framebuffer emulation')
 
+  def setRenderer(self, name):
+    # Selects how frames are produced, "pillow" renders in-process while
+    # "imagemagick" uses convert. "auto" picks pillow when available.
+    if name in ['auto', 'pillow'] and renderer.available():
+      self.usePillow = True
+    else:
+      if name == 'pillow':
+        logging.warning('Pillow is not installed, using ImageMagick to render')
+      elif name not in ['auto', 'imagemagick']:
+        logging.warning('Unknown renderer "%s", using ImageMagick', name)
+      self.usePillow = False
+    logging.debug('Rendering with %s', 'Pillow' if self.usePillow else 'ImageMagick')
+
+  def usesPillow(self):
+    return self.usePillow
+
+  def setDither(self, enable):
+    # Ordered dithering when reducing to 16bit, hides banding in gradients
+    if enable and not pixelformat.available():
+      logging.warning('NumPy is not installed, cannot dither')
+      enable = False
+    self.dither = bool(enable)
+
+  def setTransition(self, mode, duration, fps):
+    self.transition.setConfiguration(mode, duration, fps)
+
+  def setOverlay(self, overlay):
+    self.overlay = overlay
+
+  def getSize(self):
+    # Size of what is shown, which is the framebuffer size unless rotated
+    if self.rotation in [90, 270]:
+      return (self.height, self.width)
+    return (self.width, self.height)
+
+  def _rotateArgs(self, rotation=None):
+    # Arguments for convert which turn a frame the right way
+    if rotation is None:
+      rotation = self.rotation
+    if rotation % 360:
+      return ['-rotate', str(rotation % 360)]
+    return []
+
+  def _toFramebuffer(self, rect):
+    # Maps a rectangle (left, top, right, bottom) in getSize() space
+    # into framebuffer space
+    width, height = self.getSize()
+    left, top, right, bottom = rect
+    if self.rotation == 90:
+      return (height - bottom, left, height - top, right)
+    elif self.rotation == 180:
+      return (width - right, height - bottom, width - left, height - top)
+    elif self.rotation == 270:
+      return (top, width - right, bottom, width - left)
+    return rect
+
+  def _fromFramebuffer(self, rect):
+    # Inverse of _toFramebuffer()
+    width, height = self.getSize()
+    left, top, right, bottom = rect
+    if self.rotation == 90:
+      return (top, height - right, bottom, height - left)
+    elif self.rotation == 180:
+      return (width - right, height - bottom, width - left, height - top)
+    elif self.rotation == 270:
+      return (width - bottom, left, width - top, right)
+    return rect
+
   def setConfigPage(self, url):
     self.url = url
 
@@ -95,6 +192,7 @@ class display:
     # Erase old picture
     if self.params is not None:
       self.clear()
+    self._closeFramebuffer()
 
     result = display.validate(tvservice_params, special)
     if result is None:
@@ -109,6 +207,9 @@ class display:
         self.enabled = False
       self.params = None
       self.special = None
+      # Without emulation there's no geometry at all
+      if self.rotation in [90, 270]:
+        return (720, 1280, '')
       return (1280, 720, '')
 
     self.width = result['width']
@@ -132,7 +233,8 @@ class display:
     if self.depth == 32:
       self.format += 'a'
 
-    return (self.width, self.height, self.params)
+    width, height = self.getSize()
+    return (width, height, self.params)
 
   def getDevice(self):
     if self.params and self.params.split(' ')[0] == 'INTERNAL':
@@ -145,6 +247,9 @@ class display:
     return self.getDevice() == '/dev/fb0' and not display._isDPI()
 
   def get(self):
+    if self.usePillow:
+      return (self._getPillow(), 'image/jpeg')
+
     if self.enabled:
       args = [
               'convert',
@@ -153,6 +258,7 @@ class display:
               '-size',
               '%dx%d' % (self.width+self.xoffset, self.height+self.yoffset),
               '%s:-' % (self.format),
+      ] + self._rotateArgs(360 - self.rotation) + [
               'jpg:-'
       ]
     else:
@@ -176,60 +282,297 @@ class display:
         'jpg:-'
       ]
 
+    result = None
     if not self.enabled:
       result = subprocess.check_output(args, stderr=self.void)
     elif self.depth in [24, 32]:
-      device = self.getDevice()
-      if self.emulate:
-        device = '/tmp/fb.bin'
-      with open(device, 'rb') as fb:
-        pip = subprocess.Popen(args, stdin=fb, stdout=subprocess.PIPE, stderr=self.void)
-        result = pip.communicate()[0]
+      pip = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=self.void)
+      result = pip.communicate(self._read())[0]
     elif self.depth == 16:
-      with open(self.getDevice(), 'rb') as fb:
-        src = subprocess.Popen(['/root/photoframe/rgb565/rgb565', 'reverse'], stdout=subprocess.PIPE, stdin=fb, stderr=self.void)
-        pip = subprocess.Popen(args, stdin=src.stdout, stdout=subprocess.PIPE)
-        src.stdout.close()
-        result = pip.communicate()[0]
+      pip = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+      result = pip.communicate(self._from565(self._read()))[0]
     else:
       logging.error('Do not know how to grab this kind of framebuffer')
     return (result, 'image/jpeg')
 
-  def _to_display(self, arguments):
-    device = self.getDevice()
+  def _changed(self):
+    # Called whenever the content of the framebuffer changes
+    self.snapshotVersion += 1
+
+  def _snapshotWidth(self, width):
+    if not width:
+      return 0
+    return min(max(int(width), 32), 1920)
+
+  def getSnapshotTag(self, width=None):
+    # Identifies the snapshot, changes whenever the screen changes
+    return '%x-%d-%d' % (self.snapshotEpoch, self.snapshotVersion, self._snapshotWidth(width))
+
+  def getSnapshot(self, width=None):
+    # Same as get() but only encodes the screen once per change, no
+    # matter how many times it is requested. Width gives a thumbnail.
+    # Returns (data, mime, tag)
+    width = self._snapshotWidth(width)
+    with self.snapshotLock:
+      version = self.snapshotVersion
+      tag = self.getSnapshotTag(width)
+      for key in list(self.snapshots.keys()):
+        if self.snapshots[key][0] != version:
+          del self.snapshots[key]
+
+      if 0 not in self.snapshots:
+        self.snapshots[0] = (version, self.get()[0])
+      if width not in self.snapshots:
+        if len(self.snapshots) > 4:
+          self.snapshots = {0 : self.snapshots[0]}
+        self.snapshots[width] = (version, self._shrink(self.snapshots[0][1], width))
+      return (self.snapshots[width][1], 'image/jpeg', tag)
+
+  def _shrink(self, data, width):
+    if data is None:
+      return None
+    if self.usePillow:
+      return renderer.shrink(data, width)
+    pip = subprocess.Popen(['convert', 'jpg:-', '-resize', '%dx>' % width, 'jpg:-'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=self.void)
+    return pip.communicate(data)[0]
+
+  def _getPillow(self):
+    if not self.enabled:
+      return renderer.encode(renderer.caption('Display off', '', 640, 360))
+
+    width = self.width + self.xoffset
+    height = self.height + self.yoffset
+    if self.depth in [24, 32]:
+      image = renderer.unpack(self._read(), width, height, self.format)
+    elif self.depth == 16:
+      data = self._from565(self._read())
+      image = renderer.unpack(data[:width * height * 3], width, height, self.format[:3])
+    else:
+      logging.error('Do not know how to grab this kind of framebuffer')
+      return None
+    return renderer.encode(renderer.rotate(image, 360 - self.rotation))
+
+  def getPixelFormat(self):
+    # Channel order and depth of prepared frames, the emulator always
+    # gets 32bit
+    return (self.format, 32 if self.emulate else self.depth)
+
+  def getSignature(self):
+    # Describes the layout of a prepared frame, frames can only be shown
+    # on a framebuffer with the exact same layout
+    return (self.width, self.height, self.xoffset, self.yoffset, self.format, self.depth, self.depth == 16 and self.dither, self.rotation)
+
+  def _to565(self, data, width=None):
+    # Converts RGB888 to what 16bit framebuffers expect
+    if width is None:
+      width = self.width + self.xoffset
+    if pixelformat.available():
+      return pixelformat.toRGB565(data, width, self.dither)
+    pip = subprocess.Popen(['/root/photoframe/rgb565/rgb565'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    return pip.communicate(data)[0]
+
+  def _from565(self, data):
+    if pixelformat.available():
+      return pixelformat.fromRGB565(data)
+    pip = subprocess.Popen(['/root/photoframe/rgb565/rgb565', 'reverse'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=self.void)
+    return pip.communicate(data)[0]
+
+  def _render(self, arguments):
+    # Runs the conversion and returns the raw framebuffer data
+    if self.emulate:
+      self.depth = 32
+
+    if self.depth not in [16, 24, 32]:
+      logging.error('Do not know how to render this, depth is %d', self.depth)
+      return None
+
+    try:
+      data = subprocess.check_output(arguments, stderr=self.void)
+    except subprocess.CalledProcessError:
+      logging.exception('Unable to render frame')
+      return None
+    if self.depth == 16: # Typically RGB565
+      return self._to565(data)
+    return data
+
+  def _pack(self, image):
+    # Pillow counterpart to _render(), image must have the full framebuffer size
     if self.emulate:
-      device = '/tmp/fb.bin'
       self.depth = 32
 
     if self.depth in [24, 32]:
-      with open(device, 'wb') as f:
-        ret = subprocess.call(arguments, stdout=f, stderr=self.void)
+      return renderer.pack(image, self.format)
     elif self.depth == 16: # Typically RGB565
-      # For some odd reason, cannot pipe the output directly to the framebuffer, use temp file
-      with open(device, 'wb') as fb:
-        src = subprocess.Popen(arguments, stdout=subprocess.PIPE, stderr=self.void)
-        pip = subprocess.Popen(['/root/photoframe/rgb565/rgb565'], stdin=src.stdout, stdout=fb)
-        src.stdout.close()
-        pip.communicate()
+      return self._to565(renderer.pack(image, self.format))
     else:
       logging.error('Do not know how to render this, depth is %d', self.depth)
+    return None
+
+  def _linelength(self):
+    # Bytes per line in the frames we produce
+    if self.depth == 16:
+      return (self.width + self.xoffset) * 2
+    return (self.width + self.xoffset) * len(self.format)
+
+  def _framebuffer(self):
+    # Maps the framebuffer on first use, returns None if it cannot be
+    # mapped, in which case we fall back to regular file access
+    device = self.getDevice()
+    if self.emulate:
+      device = '/tmp/fb.bin'
+    if self.fb is not None and self.fb.device == device:
+      return self.fb
+    if self.fbFailed == device:
+      return None
+
+    self._closeFramebuffer()
+    fb = framebuffer(device)
+    if self.emulate:
+      fb.emulate(self.width + self.xoffset, self.height + self.yoffset, 32)
+    elif not fb.open():
+      self.fbFailed = device
+      return None
+    self.fb = fb
+    return self.fb
+
+  def _closeFramebuffer(self):
+    # Needed whenever the mode changes since geometry may have changed
+    self.fbFailed = None
+    if self.fb is not None:
+      self.fb.close()
+      self.fb = None
+
+  def _read(self):
+    fb = self._framebuffer()
+    if fb is not None:
+      return fb.read(self._linelength())
+    with open(self.getDevice(), 'rb') as f:
+      return f.read(self._linelength() * (self.height + self.yoffset))
+
+  def _write(self, data, compose=True):
+    # Writes a full frame, with compose any overlay is drawn on top
+    # before it is shown
+    with self.writeLock:
+      if compose:
+        self.base = data
+        if self.overlay is not None:
+          data = self._overlaid(data)
+      fb = self._framebuffer()
+      if fb is not None:
+        fb.present(data, self._linelength())
+      else:
+        with open(self.getDevice(), 'wb') as f:
+          f.write(data)
+      self._changed()
 
     if self.emulate and not self.emulator:
-      self.emulator = emulator(self.width, self.height, device)
+      self.emulator = emulator(self.width, self.height, '/tmp/fb.bin')
+
+  def _overlaid(self, data):
+    # Returns a copy of the frame with the overlay painted on top
+    regions = list(self._paint(self.overlay, self.overlay.getRects()))
+    if len(regions) == 0:
+      return data
+    frame = bytearray(data)
+    linelength = self._linelength()
+    for region, left, top, width, height, pixel in regions:
+      row = width * pixel
+      for y in range(height):
+        offset = (top + y) * linelength + left * pixel
+        frame[offset:offset + row] = region[y * row:(y + 1) * row]
+    return bytes(frame)
+
+  def _paint(self, overlay, rects):
+    # Yields each rectangle (left, top, right, bottom) of the last full
+    # frame with the overlay on top, as (data, left, top, width, height,
+    # pixel) in framebuffer space
+    if self.base is None or not self.enabled or not renderer.available():
+      return
+    linelength = self._linelength()
+    pixel = linelength // (self.width + self.xoffset)
+    rows = len(self.base) // linelength
+    for rect in rects:
+      rect = self._toFramebuffer(rect)
+      left, top = max(0, rect[0]), max(0, rect[1])
+      right, bottom = min(self.width + self.xoffset, rect[2]), min(rows, rect[3])
+      if right <= left or bottom <= top:
+        continue
+      width, height = right - left, bottom - top
+      data = b''.join([bytes(self.base[y * linelength + left * pixel:y * linelength + right * pixel]) for y in range(top, bottom)])
+      if self.depth == 16:
+        region = renderer.unpack(self._from565(data), width, height, self.format[:3])
+      else:
+        region = renderer.unpack(data, width, height, self.format)
+      # Layers are painted the way the viewer sees them
+      region = renderer.rotate(region, 360 - self.rotation)
+      region = overlay.paint(region, self._fromFramebuffer((left, top, right, bottom)))
+      region = renderer.rotate(region, self.rotation)
+      if self.depth == 16:
+        data = self._to565(renderer.pack(region, self.format[:3]), width)
+      else:
+        data = renderer.pack(region, self.format)
+      yield (data, left, top, width, height, pixel)
+
+  def composite(self, overlay, rects):
+    # Redraws the rectangles (left, top, right, bottom) from the last
+    # full frame with the overlay on top, leaving the rest of the screen
+    with self.writeLock:
+      fb = self._framebuffer()
+      if fb is None:
+        return
+      for data, left, top, width, height, pixel in self._paint(overlay, rects):
+        fb.writeRect(data, left, top, width, height, pixel)
+      self._changed()
 
   def message(self, message):
     if not self.enabled:
       logging.debug('Don\'t bother, display is off')
       return
 
+    frame = self.prepareMessage(message)
+    if frame is not None:
+      self.show(frame)
+
+  def prepareMessage(self, message):
+    # Renders the message into a frame, see show(). Recently used
+    # messages are kept, so showing them again is instant.
+    if not self.enabled:
+      logging.debug('Don\'t bother, display is off')
+      return None
+
+    key = (message, self.url, self.getSignature())
+    with self.messageLock:
+      if key in self.messages:
+        frame = self.messages.pop(key)
+      else:
+        data = self._renderMessage(message)
+        if data is None:
+          return None
+        frame = {'signature' : self.getSignature(), 'data' : zlib.compress(data, 1)}
+      self.messages[key] = frame
+      while len(self.messages) > display.MESSAGE_CACHE:
+        self.messages.popitem(last=False)
+    return {'signature' : frame['signature'], 'data' : zlib.decompress(frame['data'])}
+
+  def prerender(self, messages):
+    # Renders a sequence of messages ahead of time, for example a countdown
+    for message in messages:
+      self.prepareMessage(message)
+
+  def _renderMessage(self, message):
     url = ''
     if self.url is not None:
       url = self.url
 
+    width, height = self.getSize()
+    if self.usePillow:
+      image = renderer.caption(message, 'Configuration available at %s' % url, width, height)
+      return self._pack(self._place(image))
+
     args = [
       'convert',
       '-size',
-      '%dx%d' % (self.width, self.height),
+      '%dx%d' % (width, height),
       '-background',
       'black',
       '-fill',
@@ -250,36 +593,109 @@ class display:
       'caption:Configuration available at %s' % url,
       '-flatten',
       '-extent',
-      '%dx%d+%d+%d' % (self.width + self.xoffset, self.height + self.yoffset, self.xoffset, self.yoffset),
+      '%dx%d+%d+%d' % (width + self.xoffset, height + self.yoffset, self.xoffset, self.yoffset),
+    ] + self._rotateArgs() + [
       '-depth',
       '8',
       '%s:-' % self.format
     ]
 
-    self._to_display(args)
+    return self._render(args)
 
-  def image(self, filename):
+  def prepare(self, filename):
+    # Converts the image into a frame which is ready to be written
+    # as-is to the framebuffer, see show()
     if not self.enabled:
       logging.debug('Don\'t bother, display is off')
-      return
+      return None
 
-    logging.debug('Showing image to user')
+    width, height = self.getSize()
+    if self.usePillow:
+      try:
+        return self.prepareImage(renderer.fit(renderer.load(filename, width, height), width, height))
+      except:
+        logging.exception('Unable to render frame')
+        return None
+
+    # Lets JPEGs decode at reduced scale, which happens before the image
+    # is turned upright
+    hint = (width, height)
+    info = imageheader.probe(filename)
+    if info is not None and imageheader.isRotated(info['orientation']):
+      hint = (height, width)
     args = [
       'convert',
+    ] + helper.getConvertLimits() + [
+      '-define',
+      'jpeg:size=%dx%d' % hint,
       filename + '[0]',
+      '-auto-orient',
       '-resize',
-      '%dx%d' % (self.width, self.height),
+      '%dx%d' % (width, height),
       '-background',
       'black',
       '-gravity',
       'center',
       '-extent',
-      '%dx%d+%d+%d' % (self.width + self.xoffset, self.height + self.yoffset, self.xoffset, self.yoffset),
+      '%dx%d+%d+%d' % (width + self.xoffset, height + self.yoffset, self.xoffset, self.yoffset),
+    ] + self._rotateArgs() + [
       '-depth',
       '8',
       '%s:-' % self.format
     ]
-    self._to_display(args)
+    data = self._render(args)
+    if data is None:
+      return None
+    return {'signature' : self.getSignature(), 'data' : data}
+
+  def _place(self, image):
+    # Turns an image of getSize() into one covering the framebuffer
+    image = renderer.rotate(image, self.rotation)
+    return renderer.extent(image, self.width + self.xoffset, self.height + self.yoffset, self.xoffset, self.yoffset)
+
+  def prepareImage(self, image):
+    # Same as prepare() but takes a Pillow image, centered if smaller
+    # than the display
+    if not self.enabled:
+      logging.debug('Don\'t bother, display is off')
+      return None
+
+    data = self._pack(self._place(image))
+    if data is None:
+      return None
+    return {'signature' : self.getSignature(), 'data' : data}
+
+  def draw(self, image):
+    # Shows a Pillow image right away without any transition, meant for
+    # animations. Returns False if the display is off.
+    frame = self.prepareImage(image)
+    if frame is None:
+      return False
+    self._write(frame['data'])
+    return True
+
+  def show(self, frame, limit=None):
+    # Shows a frame created by prepare(), returns False if the
+    # display layout has changed since it was prepared. Any transition
+    # from what is on screen is limited to limit seconds.
+    if not self.enabled:
+      logging.debug('Don\'t bother, display is off')
+      return False
+
+    if frame['signature'] != self.getSignature():
+      logging.warning('Display has changed since frame was prepared, skipping it')
+      return False
+
+    logging.debug('Showing image to user')
+    if self.transition.isEnabled() and self._framebuffer() is not None:
+      self.transition.run(self._read(), frame['data'], self.depth, self._linelength(), lambda data: self._write(data, False), limit)
+    self._write(frame['data'])
+    return True
+
+  def image(self, filename):
+    frame = self.prepare(filename)
+    if frame is not None:
+      self.show(frame)
 
   def enable(self, enable, force=False):
     if enable == self.enabled and not force:
@@ -297,6 +713,7 @@ class display:
           time.sleep(1)
           subprocess.call(['/bin/fbset', '-fb', self.getDevice(), '-depth', '8'], stderr=self.void)
           subprocess.call(['/bin/fbset', '-fb', self.getDevice(), '-depth', str(self.depth), '-xres', str(self.width), '-yres', str(self.height), '-vxres', str(self.width), '-vyres', str(self.height)], stderr=self.void)
+          self._closeFramebuffer()
         else:
           subprocess.call(['/usr/bin/vcgencmd', 'display_power', '1'], stderr=self.void)
     else:
@@ -304,27 +721,62 @@ class display:
       if self.isHDMI():
         subprocess.call(['/usr/bin/vcgencmd', 'display_power', '0'], stderr=self.void)
     self.enabled = enable
+    self._changed()
 
   def isEnabled(self):
     return self.enabled
 
   def clear(self):
-    if self.emulate:
-      self.message('')
+    self._changed()
+    self.base = None
+    fb = self._framebuffer()
+    if fb is not None:
+      fb.clear()
       return
     with open(self.getDevice(), 'wb') as f:
       subprocess.call(['cat' , '/dev/zero'], stdout=f, stderr=self.void)
 
   @staticmethod
-  def _isDPI():
+  def _framebuffers():
+    return sorted([x for x in os.listdir('/dev') if x.startswith('fb')])
+
+  @staticmethod
+  def _capabilities():
+    # What the hardware can do only changes when framebuffers come and go
+    # (driver loaded, panel attached), so it's probed once and cached
+    # until that happens or invalidate() is called. A monitor plugged into
+    # HDMI is picked up by available(refresh=True), which the web UI uses.
+    key = display._framebuffers()
+    with display._capsLock:
+      if display._caps is None or display._capsKey != key:
+        display._caps = display._probe()
+        display._capsKey = key
+      return display._caps
+
+  @staticmethod
+  def invalidate():
+    # Forces capabilities to be probed again, ie, after a driver change
+    with display._capsLock:
+      display._caps = None
+
+  @staticmethod
+  def _probe():
+    caps = {'dpi' : False, 'cea' : [], 'dmt' : []}
     if os.path.exists('/opt/vc/bin/tvservice'):
       output = subprocess.check_output(['/opt/vc/bin/tvservice', '-s'], stderr=subprocess.STDOUT)
-    else:
-      output = ''
-    return '[LCD]' in output
+      caps['dpi'] = '[LCD]' in output
+      caps['cea'] = json.loads(subprocess.check_output(['/opt/vc/bin/tvservice', '-j', '-m', 'CEA'], stderr=subprocess.STDOUT))
+      caps['dmt'] = json.loads(subprocess.check_output(['/opt/vc/bin/tvservice', '-j', '-m', 'DMT'], stderr=subprocess.STDOUT))
+    caps['internal'] = display._probeInternal(caps['dpi'])
+    logging.debug('Probed display capabilities')
+    return caps
 
   @staticmethod
-  def _internaldisplay():
+  def _isDPI():
+    return display._capabilities()['dpi']
+
+  @staticmethod
+  def _probeInternal(dpi):
     entry = {
       'mode' : 'INTERNAL',
       'code' : None,
@@ -338,32 +790,32 @@ class display:
     }
     device = '/dev/fb1'
     if not os.path.exists(device):
-      if display._isDPI():
+      if dpi:
         device = '/dev/fb0'
       else:
         device = None
     if device:
-      info = subprocess.check_output(['/bin/fbset', '-fb', device], stderr=subprocess.STDOUT).split('\n')
-      for line in info:
-        line = line.strip()
-        if line.startswith('geometry'):
-          parts = line.split(' ')
-          entry['width'] = int(parts[1])
-          entry['height'] = int(parts[2])
-          entry['depth'] = int(parts[5])
-          entry['code'] = int(device[-1])
-        # rgba 8/16,8/8,8/0,8/24 <== Detect rgba order
-        if line.startswith('rgba'):
-          m = re.search('rgba [0-9]*/([0-9]*),[0-9]*/([0-9]*),[0-9]*/([0-9]*),[0-9]*/([0-9]*)', line)
-          if m is None:
-            logging.error('fbset output has changed, cannot parse')
-            return None
-          entry['reverse'] = m.group(1) != 0
-      if entry['code'] is not None:
-        logging.debug('Internal display: ' + repr(entry))
-        return entry
+      info = framebuffer.probe(device)
+      if info is None:
+        logging.error('Unable to query %s', device)
+        return None
+      entry['width'] = info['width']
+      entry['height'] = info['height']
+      entry['depth'] = info['depth']
+      entry['code'] = int(device[-1])
+      # Red stored above blue means the bytes are in BGR order
+      entry['reverse'] = info['bitfields']['red'][0] > info['bitfields']['blue'][0]
+      logging.debug('Internal display: ' + repr(entry))
+      return entry
     return None
 
+  @staticmethod
+  def _internaldisplay():
+    internal = display._capabilities()['internal']
+    if internal is None:
+      return None
+    return dict(internal)
+
   def current(self):
     result = None
     if self.isHDMI() and os.path.exists('/opt/vc/bin/tvservice'):
@@ -390,20 +842,19 @@ class display:
     return result
 
   @staticmethod
-  def available():
-    if os.path.exists('/opt/vc/bin/tvservice'):
-      cea = json.loads(subprocess.check_output(['/opt/vc/bin/tvservice', '-j', '-m', 'CEA'], stderr=subprocess.STDOUT))
-      dmt = json.loads(subprocess.check_output(['/opt/vc/bin/tvservice', '-j', '-m', 'DMT'], stderr=subprocess.STDOUT))
-    else:
-      cea = []
-      dmt = []
+  def available(refresh=False):
+    if refresh:
+      display.invalidate()
+    caps = display._capabilities()
     result = []
-    for entry in cea:
+    for entry in caps['cea']:
+      entry = dict(entry)
       entry['mode'] = 'CEA'
       entry['depth'] = 32
       entry['reverse'] = True
       result.append(entry)
-    for entry in dmt:
+    for entry in caps['dmt']:
+      entry = dict(entry)
       entry['mode'] = 'DMT'
       entry['depth'] = 32
       entry['reverse'] = True
@@ -0,0 +1,270 @@
+# This file is part of photoframe (https://github.com/mrworf/photoframe).
+#
+# photoframe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# photoframe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with photoframe.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import mmap
+import fcntl
+import struct
+import logging
+
+try:
+  # Python 2, mmap.write() takes buffers but not memoryviews
+  view = buffer
+except NameError:
+  view = lambda data, offset, size: memoryview(data)[offset:offset + size]
+
+# Direct access to a framebuffer device through mmap. The geometry,
+# including the length of each line in memory, is read from the driver
+# so frames are placed correctly even when lines are padded.
+#
+# If the driver allows it, the virtual screen is made twice the height
+# of the visible one. Frames are then drawn off-screen and shown with a
+# single FBIOPAN_DISPLAY, so they never tear or wipe in.
+#
+# When emulating, a plain file is used instead and the geometry has to
+# be provided by the caller.
+#
+class framebuffer:
+  FBIOGET_VSCREENINFO = 0x4600
+  FBIOPUT_VSCREENINFO = 0x4601
+  FBIOGET_FSCREENINFO = 0x4602
+  FBIOPAN_DISPLAY = 0x4606
+
+  # struct fb_var_screeninfo, 40 x __u32 (see linux/fb.h)
+  VSCREENINFO = '40I'
+  # struct fb_fix_screeninfo
+  FSCREENINFO = '16sLIIIIHHHILIIHHH'
+
+  def __init__(self, device):
+    self.device = device
+    self.fd = None
+    self.mm = None
+    self.width = 0
+    self.height = 0
+    self.depth = 0
+    self.stride = 0
+    self.size = 0
+    self.bitfields = None
+    self.pages = 1
+    self.visible = 0
+    self.var = None
+
+  @staticmethod
+  def parseVariable(data):
+    # Returns the fields we care about from fb_var_screeninfo
+    v = struct.unpack_from(framebuffer.VSCREENINFO, data)
+    return {
+      'xres' : v[0],
+      'yres' : v[1],
+      'xres_virtual' : v[2],
+      'yres_virtual' : v[3],
+      'xoffset' : v[4],
+      'yoffset' : v[5],
+      'bits_per_pixel' : v[6],
+      'red' : (v[8], v[9]),
+      'green' : (v[11], v[12]),
+      'blue' : (v[14], v[15]),
+      'transp' : (v[17], v[18]),
+    }
+
+  @staticmethod
+  def parseFixed(data):
+    f = struct.unpack_from(framebuffer.FSCREENINFO, data)
+    return {
+      'id' : f[0].split(b'\0')[0].decode('ascii', 'ignore'),
+      'smem_len' : f[2],
+      'ypanstep' : f[7],
+      'line_length' : f[9],
+    }
+
+  def getVariable(self):
+    data = fcntl.ioctl(self.fd, framebuffer.FBIOGET_VSCREENINFO, b'\0' * struct.calcsize(framebuffer.VSCREENINFO))
+    return framebuffer.parseVariable(data), data
+
+  def getFixed(self):
+    # Leave room for any trailing padding the kernel adds to the struct
+    data = fcntl.ioctl(self.fd, framebuffer.FBIOGET_FSCREENINFO, b'\0' * (struct.calcsize(framebuffer.FSCREENINFO) + 16))
+    return framebuffer.parseFixed(data)
+
+  @staticmethod
+  def probe(device):
+    # Reads the geometry of a device without mapping it, returns None
+    # if it isn't a usable framebuffer
+    fb = framebuffer(device)
+    try:
+      fb.fd = os.open(device, os.O_RDONLY)
+      var, raw = fb.getVariable()
+      fix = fb.getFixed()
+    except:
+      logging.debug('Unable to probe framebuffer %s', device)
+      return None
+    finally:
+      fb.close()
+    return {
+      'id' : fix['id'],
+      'width' : var['xres'],
+      'height' : var['yres'],
+      'depth' : var['bits_per_pixel'],
+      'stride' : fix['line_length'],
+      'bitfields' : {'red' : var['red'], 'green' : var['green'], 'blue' : var['blue'], 'transp' : var['transp']},
+    }
+
+  def _allocatePages(self, var, raw, fix):
+    # Tries to get a virtual screen which can hold two frames
+    yres = var['yres']
+    if fix['ypanstep'] == 0 or yres % fix['ypanstep'] != 0:
+      logging.debug('%s cannot pan, not double buffering', self.device)
+      return var, raw, fix
+    if var['yres_virtual'] < 2 * yres:
+      values = list(struct.unpack_from(framebuffer.VSCREENINFO, raw))
+      values[3] = 2 * yres
+      values[5] = 0
+      try:
+        fcntl.ioctl(self.fd, framebuffer.FBIOPUT_VSCREENINFO, struct.pack(framebuffer.VSCREENINFO, *values))
+      except IOError:
+        logging.debug('%s refused a larger virtual screen, not double buffering', self.device)
+        return var, raw, fix
+      var, raw = self.getVariable()
+      fix = self.getFixed()
+    if var['yres_virtual'] >= 2 * yres and fix['smem_len'] >= 2 * yres * fix['line_length']:
+      self.pages = 2
+    return var, raw, fix
+
+  def open(self, doublebuffer=True):
+    # Maps the device, returns False if it cannot be used
+    self.close()
+    try:
+      self.fd = os.open(self.device, os.O_RDWR)
+      var, raw = self.getVariable()
+      fix = self.getFixed()
+      if doublebuffer:
+        var, raw, fix = self._allocatePages(var, raw, fix)
+      self.var = list(struct.unpack_from(framebuffer.VSCREENINFO, raw))
+      self.width = var['xres']
+      self.height = var['yres']
+      self.depth = var['bits_per_pixel']
+      self.stride = fix['line_length']
+      self.bitfields = {'red' : var['red'], 'green' : var['green'], 'blue' : var['blue'], 'transp' : var['transp']}
+      self.size = min(fix['smem_len'], self.stride * var['yres_virtual'])
+      self.mm = mmap.mmap(self.fd, self.size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+    except:
+      logging.exception('Unable to map framebuffer %s', self.device)
+      self.close()
+      return False
+    self.visible = 0
+    if self.pages > 1 and not self.pan(0):
+      self.pages = 1
+    logging.debug('Mapped %s, %dx%d %dbit, %d bytes per line, %d page(s)', self.device, self.width, self.height, self.depth, self.stride, self.pages)
+    return True
+
+  def pan(self, page):
+    # Makes page the visible one, returns False if the driver refuses
+    values = list(self.var)
+    values[4] = 0
+    values[5] = page * self.height
+    try:
+      fcntl.ioctl(self.fd, framebuffer.FBIOPAN_DISPLAY, struct.pack(framebuffer.VSCREENINFO, *values))
+    except IOError:
+      logging.exception('Unable to pan %s', self.device)
+      return False
+    self.visible = page
+    return True
+
+  def present(self, data, linelength):
+    # Shows a frame, drawing it off-screen first when double buffering.
+    # Falls back to drawing on the visible page if panning stops working.
+    if self.pages > 1:
+      back = 1 - self.visible
+      self.write(data, linelength, back * self.height)
+      if self.pan(back):
+        return
+      self.pages = 1
+    self.write(data, linelength, self.visible * self.height)
+
+  def emulate(self, width, height, depth):
+    # Uses a plain file with the provided geometry instead of a device
+    self.close()
+    self.width = width
+    self.height = height
+    self.depth = depth
+    self.stride = width * depth // 8
+    self.size = self.stride * height
+    self.bitfields = None
+    self.pages = 1
+    self.visible = 0
+    with open(self.device, 'ab') as f:
+      f.truncate(self.size)
+    self.fd = os.open(self.device, os.O_RDWR)
+    self.mm = mmap.mmap(self.fd, self.size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+    return True
+
+  def close(self):
+    if self.mm is not None:
+      self.mm.close()
+      self.mm = None
+    if self.fd is not None:
+      os.close(self.fd)
+      self.fd = None
+
+  def write(self, data, linelength, top=0):
+    # Copies rows of linelength bytes into the framebuffer starting at
+    # line top. When the layout matches it's a single copy, otherwise it
+    # goes row by row without creating intermediate copies.
+    rows = min(len(data) // linelength, self.height)
+    base = top * self.stride
+    if linelength == self.stride:
+      self.mm.seek(base)
+      self.mm.write(view(data, 0, rows * linelength))
+      return
+
+    count = min(linelength, self.stride)
+    for y in range(rows):
+      self.mm.seek(base + y * self.stride)
+      self.mm.write(view(data, y * linelength, count))
+
+  def writeRect(self, data, left, top, width, height, pixel):
+    # Copies a rectangle of width x height pixels, pixel bytes each, to
+    # the visible page
+    base = (self.visible * self.height + top) * self.stride + left * pixel
+    row = width * pixel
+    for y in range(height):
+      self.mm.seek(base + y * self.stride)
+      self.mm.write(view(data, y * row, row))
+
+  def read(self, linelength):
+    # Returns the visible frame with rows of linelength bytes
+    base = self.visible * self.height * self.stride
+    if linelength == self.stride:
+      return self.mm[base:base + self.height * self.stride]
+    count = min(linelength, self.stride)
+    padding = b'\0' * (linelength - count)
+    rows = []
+    for y in range(self.height):
+      offset = base + y * self.stride
+      rows.append(self.mm[offset:offset + count] + padding)
+    return b''.join(rows)
+
+  def clear(self):
+    # Blanks the screen, off-screen first when double buffering
+    page = self.visible
+    if self.pages > 1:
+      page = 1 - page
+    blank = b'\0' * self.stride
+    self.mm.seek(page * self.height * self.stride)
+    for y in range(self.height):
+      self.mm.write(blank)
+    if page != self.visible and not self.pan(page):
+      self.pages = 1
+      self.clear()
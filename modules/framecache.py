@@ -0,0 +1,181 @@
+# This file is part of photoframe (https://github.com/mrworf/photoframe).
+#
+# photoframe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# photoframe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with photoframe.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os
+import zlib
+import hashlib
+import logging
+import threading
+import time
+import random
+
+# Keeps rendered frames on disk so photos which come around again don't
+# have to be downloaded and processed a second time.
+#
+# Entries are grouped, a group holds all frames rendered with the same
+# display parameters. Each entry is stored as <group>-<key>.frame and
+# the file's modification time is used to track when it was last used,
+# which is what decides what gets evicted once the size budget is exceeded.
+# Frames are compressed, like display does for messages, which spares
+# the SD card most of the writing since photos are mostly smooth.
+# The photo's caption, if any, is kept next to it as <group>-<key>.caption
+# since the photo itself is gone by the time the frame is reused.
+#
+class framecache:
+  def __init__(self, folder, budget):
+    self.folder = folder
+    self.budget = 0
+    self.lock = threading.Lock()
+    self.entries = {}
+    self.total = 0
+    self.lastPicked = None
+
+    if not os.path.exists(self.folder):
+      os.mkdir(self.folder)
+    self._scan()
+    self.setBudget(budget)
+
+  def _scan(self):
+    names = os.listdir(self.folder)
+    for name in names:
+      filename = os.path.join(self.folder, name)
+      if name.endswith('.caption') and name[:-8] + '.frame' in names:
+        continue
+      if not name.endswith('.frame'):
+        # Leftovers from an interrupted write
+        os.unlink(filename)
+        continue
+      info = os.stat(filename)
+      self.entries[name] = {'size' : info.st_size, 'used' : info.st_mtime}
+      self.total += info.st_size
+    logging.debug('Frame cache holds %d frames (%d bytes)', len(self.entries), self.total)
+
+  def _hash(self, text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+  def _name(self, group, key):
+    return '%s-%s.frame' % (self._hash(group)[:16], self._hash(key))
+
+  def setBudget(self, budget):
+    # Budget is in megabytes, zero disables the cache
+    if type(budget) not in [int, float] or budget < 0:
+      logging.warning('Invalid cache size %s, disabling cache', repr(budget))
+      budget = 0
+    with self.lock:
+      self.budget = int(budget * 1024 * 1024)
+      self._evict()
+
+  def isEnabled(self):
+    return self.budget > 0
+
+  def has(self, group, key):
+    with self.lock:
+      return self.isEnabled() and self._name(group, key) in self.entries
+
+  def _caption(self, name):
+    filename = os.path.join(self.folder, name[:-6] + '.caption')
+    if not os.path.exists(filename):
+      return None
+    with open(filename, 'rb') as f:
+      return f.read().decode('utf-8')
+
+  def get(self, group, key):
+    # Returns the stored data and caption as {'data', 'caption'} or None
+    # if there's no such entry
+    name = self._name(group, key)
+    with self.lock:
+      if not self.isEnabled() or name not in self.entries:
+        return None
+      filename = os.path.join(self.folder, name)
+      try:
+        with open(filename, 'rb') as f:
+          data = zlib.decompress(f.read())
+        caption = self._caption(name)
+        os.utime(filename, None)
+      except:
+        logging.exception('Unable to read cached frame, dropping it')
+        self._remove(name)
+        return None
+      self.entries[name]['used'] = time.time()
+    return {'data' : data, 'caption' : caption}
+
+  def pick(self, group):
+    # Returns a random entry from the group, like get(), or None if the
+    # group is empty. Avoids returning the same frame twice in a row.
+    prefix = self._hash(group)[:16] + '-'
+    with self.lock:
+      if not self.isEnabled():
+        return None
+      names = [x for x in self.entries if x.startswith(prefix)]
+    if len(names) > 1 and self.lastPicked in names:
+      names.remove(self.lastPicked)
+
+    while len(names) > 0:
+      name = random.SystemRandom().choice(names)
+      names.remove(name)
+      try:
+        with open(os.path.join(self.folder, name), 'rb') as f:
+          data = zlib.decompress(f.read())
+        caption = self._caption(name)
+      except:
+        logging.exception('Unable to read cached frame')
+        continue
+      self.lastPicked = name
+      return {'data' : data, 'caption' : caption}
+    return None
+
+  def put(self, group, key, data, caption=None):
+    name = self._name(group, key)
+    data = zlib.compress(data, 1)
+    with self.lock:
+      if len(data) > self.budget:
+        return False
+      if name in self.entries:
+        self._remove(name)
+      filename = os.path.join(self.folder, name)
+      try:
+        if caption:
+          with open(filename[:-6] + '.caption', 'wb') as f:
+            f.write(caption.encode('utf-8'))
+        with open(filename + '.tmp', 'wb') as f:
+          f.write(data)
+        os.rename(filename + '.tmp', filename)
+      except:
+        logging.exception('Unable to store frame in cache')
+        if os.path.exists(filename + '.tmp'):
+          os.unlink(filename + '.tmp')
+        return False
+      self.entries[name] = {'size' : len(data), 'used' : time.time()}
+      self.total += len(data)
+      self._evict()
+    return True
+
+  def _remove(self, name):
+    entry = self.entries.pop(name)
+    self.total -= entry['size']
+    for filename in [name, name[:-6] + '.caption']:
+      filename = os.path.join(self.folder, filename)
+      if os.path.exists(filename):
+        os.unlink(filename)
+
+  def _evict(self):
+    # Least recently used goes first
+    if self.total <= self.budget:
+      return
+    for name in sorted(self.entries, key=lambda k: self.entries[k]['used']):
+      self._remove(name)
+      if self.total <= self.budget:
+        break
+    logging.debug('Frame cache trimmed to %d bytes', self.total)
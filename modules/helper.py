@@ -19,6 +19,10 @@ import logging
 import os
 import re
 
+from modules.blur import blur
+from modules.imageheader import imageheader
+from modules.renderer import renderer
+
 class helper:
 	@staticmethod
 	def getResolution():
@@ -58,23 +62,50 @@ class helper:
 		return None
 
 	@staticmethod
-	def makeFullframe(filename, displayWidth, displayHeight, zoomOnly=False, autoChoose=False):
-		name, ext = os.path.splitext(filename)
-		filename_temp = "%s-frame%s" % (name, ext)
+	def getConvertLimits():
+		# Holds convert to the same ceiling as the Pillow renderer. Anything
+		# bigger goes to ImageMagick's disk cache instead of memory, which is
+		# slow but won't take the frame down. A pixel takes 8 bytes in the
+		# usual 16 bit build of ImageMagick.
+		return [
+			'-limit',
+			'area',
+			'%dMP' % (renderer.MAXPIXELS // 1000000),
+			'-limit',
+			'memory',
+			'%dMiB' % (renderer.MAXPIXELS * 8 // (1024 * 1024))
+		]
+
+	@staticmethod
+	def getImageSize(filename):
+		# Size as the image is shown, taken from the header when possible
+		info = imageheader.probe(filename)
+		if info is not None:
+			return (info['width'], info['height'])
 
 		with open(os.devnull, 'wb') as void:
 			try:
 				output = subprocess.check_output(['/usr/bin/identify', filename], stderr=void)
 			except:
 				logging.exception('Error trying to identify image')
-				return False
+				return None
 
 		m = re.search('([1-9][0-9]*)x([1-9][0-9]*)', output)
 		if m is None or m.groups() is None or len(m.groups()) != 2:
 			logging.error('Unable to resolve regular expression for image size')
-			return False
-		width = int(m.group(1))
-		height = int(m.group(2))
+			return None
+		return (int(m.group(1)), int(m.group(2)))
+
+	@staticmethod
+	def makeFullframe(filename, displayWidth, displayHeight, zoomOnly=False, autoChoose=False, imageSize=None):
+		name, ext = os.path.splitext(filename)
+		filename_temp = "%s-frame%s" % (name, ext)
+
+		if imageSize is None:
+			imageSize = helper.getImageSize(filename)
+			if imageSize is None:
+				return False
+		width, height = imageSize
 
 		width_border = 15
 		width_spacing = 3
@@ -116,13 +147,24 @@ class helper:
 		if padding < 60 and autoChoose:
 			zoomOnly = True
 
+		# The decoder works before the image is turned upright
+		hint = (displayWidth, displayHeight)
+		info = imageheader.probe(filename)
+		if info is not None and imageheader.isRotated(info['orientation']):
+			hint = (displayHeight, displayWidth)
+
 		cmd = None
 		try:
 			# Time to process
 			if zoomOnly:
 				cmd = [
 					'convert',
+				] + helper.getConvertLimits() + [
+					# Lets JPEGs decode at reduced scale
+					'-define',
+					'jpeg:size=%sx%s' % hint,
 					filename + '[0]',
+					'-auto-orient',
 					'-resize',
 					resizeString % (displayWidth, displayHeight),
 					'-gravity',
@@ -135,7 +177,12 @@ class helper:
 			else:
 				cmd = [
 					'convert',
+				] + helper.getConvertLimits() + [
+					# Lets JPEGs decode at reduced scale
+					'-define',
+					'jpeg:size=%sx%s' % hint,
 					filename + '[0]',
+					'-auto-orient',
 					'-resize',
 					resizeString % (displayWidth, displayHeight),
 					'-gravity',
@@ -143,12 +190,18 @@ class helper:
 					'-crop',
 					'%sx%s+0+0' % (displayWidth, displayHeight),
 					'+repage',
+					# Blurring a downscaled copy looks the same but is much faster
+					'-scale',
+					'%g%%' % (100.0 / blur.FACTOR),
 					'-blur',
-					'0x12',
+					'0x%g' % (12.0 / blur.FACTOR),
+					'-resize',
+					'%sx%s!' % (displayWidth, displayHeight),
 					'-brightness-contrast',
 					'-20x0',
 					'(',
 					filename + '[0]',
+					'-auto-orient',
 					'-bordercolor',
 					'black',
 					'-border',
@@ -0,0 +1,129 @@
+# This file is part of photoframe (https://github.com/mrworf/photoframe).
+#
+# photoframe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# photoframe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with photoframe.  If not, see <http://www.gnu.org/licenses/>.
+#
+import threading
+from array import array
+
+NAN = float('nan')
+
+# Fixed size circular buffer of readings, one array per column so it
+# takes 4 bytes per value no matter how many readings it holds
+class ring:
+  def __init__(self, size, columns):
+    self.size = size
+    self.head = 0
+    self.count = 0
+    self.time = array('d', [0.0]) * size
+    self.columns = [array('f', [0.0]) * size for x in range(columns)]
+
+  def append(self, time, values):
+    self.time[self.head] = time
+    for column, value in zip(self.columns, values):
+      column[self.head] = value
+    self.head = (self.head + 1) % self.size
+    self.count = min(self.count + 1, self.size)
+
+  def select(self, since=None, until=None):
+    # Returns the times and columns of readings in the period, oldest first
+    first = (self.head - self.count) % self.size
+    order = [(first + i) % self.size for i in range(self.count)]
+    order = [i for i in order if (since is None or self.time[i] >= since) and (until is None or self.time[i] < until)]
+    return [self.time[i] for i in order], [[column[i] for i in order] for column in self.columns]
+
+# Keeps what the color sensor has seen at a few resolutions, so memory
+# use is fixed no matter how long we run: every reading for the last
+# hour, averages per minute for a day and per 10 minutes for a month.
+# Averaged entries also hold the lowest and highest lux seen, which is
+# what matters when picking autooff-lux.
+class history:
+  RAW = 0
+  # How many seconds of readings RAW covers. Sampling slows down to once
+  # every 30 seconds when the light is steady, so RAW is trimmed by age
+  # rather than count.
+  SPAN = 3600
+  # Resolution in seconds and how many entries to keep. Readings come
+  # at most once a second, so RAW has room for a full SPAN.
+  LEVELS = [
+    (RAW, 3600),
+    (60, 24 * 60),
+    (600, 31 * 24 * 6),
+  ]
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.rings = {}
+    self.pending = {}
+    self.latest = None
+    for resolution, size in history.LEVELS:
+      self.rings[resolution] = ring(size, 2 if resolution == history.RAW else 4)
+
+  def add(self, time, temperature, lux):
+    # Temperature is None when not known
+    with self.lock:
+      self.latest = time
+      self.rings[history.RAW].append(time, (NAN if temperature is None else temperature, lux))
+      for resolution in self.rings:
+        if resolution == history.RAW:
+          continue
+        start = time - time % resolution
+        period = self.pending.get(resolution)
+        if period is not None and period['start'] != start:
+          self._store(resolution, period)
+          period = None
+        if period is None:
+          period = {'start' : start, 'temperature' : 0.0, 'known' : 0, 'lux' : 0.0, 'count' : 0, 'min' : lux, 'max' : lux}
+          self.pending[resolution] = period
+        if temperature is not None:
+          period['temperature'] += temperature
+          period['known'] += 1
+        period['lux'] += lux
+        period['count'] += 1
+        period['min'] = min(period['min'], lux)
+        period['max'] = max(period['max'], lux)
+
+  def _average(self, period):
+    temperature = period['temperature'] / period['known'] if period['known'] else NAN
+    return (temperature, period['lux'] / period['count'], period['min'], period['max'])
+
+  def _store(self, resolution, period):
+    self.rings[resolution].append(period['start'], self._average(period))
+
+  def get(self, resolution, since=None, until=None):
+    # Returns the readings in the period as columns, oldest first. The
+    # period which is still being collected is included.
+    if resolution not in self.rings:
+      return None
+    with self.lock:
+      if resolution == history.RAW and self.latest is not None:
+        oldest = self.latest - history.SPAN
+        since = oldest if since is None else max(since, oldest)
+      times, columns = self.rings[resolution].select(since, until)
+      period = self.pending.get(resolution)
+      if period is not None and (since is None or period['start'] >= since) and (until is None or period['start'] < until):
+        times.append(period['start'])
+        for column, value in zip(columns, self._average(period)):
+          column.append(value)
+
+    # NaN isn't valid JSON
+    result = {
+      'resolution' : resolution,
+      'time' : times,
+      'temperature' : [None if x != x else round(x) for x in columns[0]],
+      'lux' : [round(x, 1) for x in columns[1]],
+    }
+    if resolution != history.RAW:
+      result['lux-min'] = [round(x, 1) for x in columns[2]]
+      result['lux-max'] = [round(x, 1) for x in columns[3]]
+    return result
@@ -0,0 +1,129 @@
+# This file is part of photoframe (https://github.com/mrworf/photoframe).
+#
+# photoframe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# photoframe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with photoframe.  If not, see <http://www.gnu.org/licenses/>.
+#
+import logging
+import struct
+
+# Reads the dimensions (and EXIF orientation for JPEGs) of an image from
+# its header, so we don't have to run identify or decode it. Only the
+# few bytes needed are read, JPEG segments are skipped over rather than
+# read.
+class imageheader:
+  # EXIF orientations where the image has to be turned 90 degrees
+  ROTATED = [5, 6, 7, 8]
+
+  # JPEG markers without a length
+  STANDALONE = [0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8]
+
+  @staticmethod
+  def probe(filename):
+    # Returns format, width, height and orientation (1 is upright) or None
+    # if this isn't a format we know. Width and height are as the image
+    # is meant to be shown, so swapped for turned photos.
+    try:
+      with open(filename, 'rb') as f:
+        header = bytearray(f.read(26))
+        if header[:2] == b'\xff\xd8':
+          info = imageheader._jpeg(f)
+        elif header[:8] == b'\x89PNG\r\n\x1a\n' and header[12:16] == b'IHDR':
+          info = ('png',) + struct.unpack('>II', bytes(header[16:24])) + (1,)
+        elif header[:6] in [b'GIF87a', b'GIF89a']:
+          info = ('gif',) + struct.unpack('<HH', bytes(header[6:10])) + (1,)
+        elif header[:2] == b'BM':
+          info = imageheader._bmp(header)
+        else:
+          info = None
+    except (IOError, struct.error, IndexError, ValueError):
+      # Malformed headers are left to identify
+      logging.exception('Unable to read header of %s', filename)
+      return None
+    if info is None:
+      return None
+
+    format, width, height, orientation = info
+    if orientation in imageheader.ROTATED:
+      width, height = height, width
+    return {'format' : format, 'width' : width, 'height' : height, 'orientation' : orientation}
+
+  @staticmethod
+  def isRotated(orientation):
+    return orientation in imageheader.ROTATED
+
+  @staticmethod
+  def _bmp(header):
+    size = struct.unpack('<I', bytes(header[14:18]))[0]
+    if size == 12:
+      width, height = struct.unpack('<HH', bytes(header[18:22]))
+    else:
+      # Height is negative for images stored top down
+      width, height = struct.unpack('<ii', bytes(header[18:26]))
+    return ('bmp', abs(width), abs(height), 1)
+
+  @staticmethod
+  def _jpeg(f):
+    # Walks the segments until the frame header, picking up orientation
+    # from the EXIF segment on the way
+    f.seek(2)
+    orientation = 1
+    while True:
+      marker = bytearray(f.read(2))
+      if len(marker) < 2 or marker[0] != 0xFF:
+        return None
+      # Any number of 0xFF may pad before a marker
+      while marker[1] == 0xFF:
+        padding = bytearray(f.read(1))
+        if len(padding) == 0:
+          return None
+        marker = marker[1:] + padding
+      code = marker[1]
+      if code in imageheader.STANDALONE:
+        continue
+      length = struct.unpack('>H', f.read(2))[0]
+      if code in [0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF]:
+        height, width = struct.unpack('>xHH', f.read(5))
+        return ('jpeg', width, height, orientation)
+      if code == 0xDA:
+        # Start of scan without a frame header
+        return None
+      if code == 0xE1:
+        segment = bytearray(f.read(length - 2))
+        if segment[:6] == b'Exif\x00\x00':
+          orientation = imageheader._orientation(segment[6:])
+      else:
+        f.seek(length - 2, 1)
+
+  @staticmethod
+  def _orientation(tiff):
+    # Finds tag 0x0112 in the first IFD of the EXIF data
+    try:
+      if tiff[:2] == b'II':
+        order = '<'
+      elif tiff[:2] == b'MM':
+        order = '>'
+      else:
+        return 1
+      offset = struct.unpack(order + 'I', bytes(tiff[4:8]))[0]
+      count = struct.unpack(order + 'H', bytes(tiff[offset:offset + 2]))[0]
+      for i in range(count):
+        entry = offset + 2 + i * 12
+        tag, kind = struct.unpack(order + 'HH', bytes(tiff[entry:entry + 4]))
+        if tag == 0x0112 and kind == 3:
+          value = struct.unpack(order + 'H', bytes(tiff[entry + 8:entry + 10]))[0]
+          if 1 <= value <= 8:
+            return value
+          return 1
+    except struct.error:
+      pass
+    return 1
@@ -0,0 +1,131 @@
+# This file is part of photoframe (https://github.com/mrworf/photoframe).
+#
+# photoframe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# photoframe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with photoframe.  If not, see <http://www.gnu.org/licenses/>.
+#
+import logging
+import random
+import time
+
+from modules.renderer import renderer
+
+try:
+  from PIL import Image
+except ImportError:
+  Image = None
+
+# Slowly pans and zooms across an image while it's shown. The source is
+# kept in memory scaled to slightly more than what is needed to cover the
+# screen, and the crop for every step of the display period is worked out
+# when the item is prepared. Each step is then just a resample of that
+# crop. Time spent per step is measured, and the framerate is lowered
+# whenever the animation would use more than half of the CPU.
+class kenburns:
+  # How much larger than the screen the source is kept, which is also
+  # how far we zoom in
+  ZOOM = 1.25
+
+  # Largest share of time animation may take between steps
+  BUDGET = 0.5
+
+  def __init__(self):
+    self.fps = 8
+    self.rate = self.fps
+    # Moving average of seconds needed per step
+    self.spent = None
+
+  @staticmethod
+  def available():
+    return renderer.available()
+
+  def setFramerate(self, fps):
+    self.fps = max(1, int(fps))
+    self.rate = self.fps
+    self.spent = None
+
+  def load(self, source, width, height, duration):
+    # Returns the animation for showing source, a filename or an RGB
+    # Pillow image, on a width x height screen for duration seconds
+    if not hasattr(source, 'size'):
+      source = renderer.load(source, int(width * kenburns.ZOOM), int(height * kenburns.ZOOM))
+    scale = max(float(width) / source.size[0], float(height) / source.size[1]) * kenburns.ZOOM
+    if scale < 1.0:
+      size = (max(1, int(source.size[0] * scale)), max(1, int(source.size[1] * scale)))
+      source = source.resize(size, Image.BILINEAR)
+
+    return {
+      'source' : source,
+      'width' : width,
+      'height' : height,
+      'path' : self._path(source.size, width, height, duration),
+    }
+
+  def _path(self, size, width, height, duration):
+    # Largest crop with the aspect of the screen, start and end are
+    # picked at random between that and a zoomed in version of it
+    aspect = float(width) / height
+    cw, ch = float(size[0]), float(size[0]) / aspect
+    if ch > size[1]:
+      cw, ch = size[1] * aspect, float(size[1])
+
+    zoom = [1.0, 1.0 / kenburns.ZOOM]
+    random.shuffle(zoom)
+    rects = []
+    for factor in zoom:
+      w, h = cw * factor, ch * factor
+      rects.append((random.uniform(0, size[0] - w), random.uniform(0, size[1] - h), w, h))
+
+    steps = max(2, int(duration * self.fps) + 1)
+    path = []
+    for i in range(steps):
+      t = float(i) / (steps - 1)
+      path.append(tuple([a + (b - a) * t for a, b in zip(rects[0], rects[1])]))
+    return path
+
+  def render(self, animation, position):
+    # Returns the image at position (0 to 1) along the path
+    path = animation['path']
+    x, y, w, h = path[min(len(path) - 1, int(position * (len(path) - 1)))]
+    size = (animation['width'], animation['height'])
+    box = (int(x), int(y), int(x + w), int(y + h))
+    try:
+      return animation['source'].resize(size, Image.BILINEAR, box)
+    except TypeError:
+      # Pillow before 4.3 can't resample a region directly
+      return animation['source'].crop(box).resize(size, Image.BILINEAR)
+
+  def run(self, animation, duration, draw, wait):
+    # Animates for duration seconds using draw(image) to show each step
+    # and wait(seconds) to pause between them. Returns True if wait()
+    # was interrupted.
+    start = time.time()
+    while True:
+      begin = time.time()
+      position = (begin - start) / duration if duration > 0 else 1.0
+      if position >= 1.0:
+        return False
+      if not draw(self.render(animation, position)):
+        return wait(max(0, duration - (time.time() - start)))
+      self._measure(time.time() - begin)
+      if wait(max(0, 1.0 / self.rate - (time.time() - begin))):
+        return True
+
+  def _measure(self, spent):
+    if self.spent is None:
+      self.spent = spent
+    else:
+      self.spent = self.spent * 0.8 + spent * 0.2
+    rate = max(1, min(self.fps, int(kenburns.BUDGET / max(self.spent, 0.001))))
+    if rate != self.rate:
+      logging.info('Pan and zoom takes %.3fs per step, running at %d fps', self.spent, rate)
+      self.rate = rate
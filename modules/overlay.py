@@ -0,0 +1,125 @@
+# This file is part of photoframe (https://github.com/mrworf/photoframe).
+#
+# photoframe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# photoframe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with photoframe.  If not, see <http://www.gnu.org/licenses/>.
+#
+import logging
+import time
+from threading import Thread, Event, Lock
+
+from modules.renderer import renderer
+
+# Small layers drawn on top of whatever the display shows (clock, photo
+# caption, status badge). Layers are rendered once into RGBA images and
+# composited onto the region of the last full frame they cover, so an
+# update only rewrites that rectangle of the framebuffer and never
+# touches the photo itself.
+#
+# The display calls paint() for each full frame to put all layers on top
+# of it before it is shown.
+class overlay:
+  MARGIN = 16
+  POINTSIZE = 28
+
+  def __init__(self, display):
+    self.display = display
+    self.layers = {}
+    self.texts = {}
+    self.lock = Lock()
+    self.clock = False
+    self.stopped = None
+    self.thread = None
+
+  @staticmethod
+  def available():
+    return renderer.available()
+
+  def setClock(self, enable):
+    # The clock is updated once a minute by its own thread
+    self.clock = bool(enable) and overlay.available()
+    if self.clock and self.thread is None:
+      self.stopped = Event()
+      self.thread = Thread(target=self._tick, args=(self.stopped,))
+      self.thread.daemon = True
+      self.thread.start()
+    elif not self.clock and self.thread is not None:
+      self.stopped.set()
+      self.thread = None
+      self._setText('clock', None, 'bottom-right', True)
+
+  def setCaption(self, text, redraw=True):
+    self._setText('caption', text, 'bottom-left', redraw)
+
+  def setStatus(self, text, redraw=True):
+    self._setText('status', text, 'top-right', redraw)
+
+  def _setText(self, name, text, anchor, redraw):
+    if not overlay.available() or self.texts.get(name) == text:
+      return
+    self.texts[name] = text
+    image = None
+    if text:
+      image = renderer.label(text, overlay.POINTSIZE)
+    self.setLayer(name, image, anchor, redraw)
+
+  def _position(self, image, anchor):
+    # Top left corner of image when placed at anchor
+    width, height = self.display.getSize()
+    x = overlay.MARGIN
+    y = overlay.MARGIN
+    if anchor.endswith('right'):
+      x = width - image.size[0] - overlay.MARGIN
+    if anchor.startswith('bottom'):
+      y = height - image.size[1] - overlay.MARGIN
+    return (max(0, x), max(0, y))
+
+  def setLayer(self, name, image, anchor='top-left', redraw=True):
+    # Sets (or removes when image is None) a layer. With redraw, only the
+    # area covered by the old and new layer is updated on screen.
+    with self.lock:
+      dirty = []
+      if name in self.layers:
+        dirty.append(self.layers[name]['rect'])
+        del self.layers[name]
+      if image is not None:
+        x, y = self._position(image, anchor)
+        self.layers[name] = {'image' : image, 'rect' : (x, y, x + image.size[0], y + image.size[1])}
+        dirty.append(self.layers[name]['rect'])
+    if redraw and dirty:
+      self.display.composite(self, [overlay._union(dirty)])
+
+  @staticmethod
+  def _union(rects):
+    return (min([r[0] for r in rects]), min([r[1] for r in rects]), max([r[2] for r in rects]), max([r[3] for r in rects]))
+
+  def getRects(self):
+    with self.lock:
+      return [self.layers[x]['rect'] for x in self.layers]
+
+  def paint(self, region, rect):
+    # Draws all layers covering rect onto region, an RGB image of rect
+    with self.lock:
+      for name in self.layers:
+        layer = self.layers[name]
+        left, top = layer['rect'][0] - rect[0], layer['rect'][1] - rect[1]
+        if layer['rect'][2] <= rect[0] or layer['rect'][0] >= rect[2] or layer['rect'][3] <= rect[1] or layer['rect'][1] >= rect[3]:
+          continue
+        region.paste(layer['image'], (left, top), layer['image'])
+    return region
+
+  def _tick(self, stopped):
+    while not stopped.is_set():
+      self._setText('clock', time.strftime('%H:%M'), 'bottom-right', True)
+      # Wake up right after the minute changes
+      stopped.wait(60 - time.time() % 60 + 0.1)
+    logging.debug('Clock overlay has stopped')
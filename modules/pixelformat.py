@@ -0,0 +1,78 @@
+# This file is part of photoframe (https://github.com/mrworf/photoframe).
+#
+# photoframe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# photoframe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with photoframe.  If not, see <http://www.gnu.org/licenses/>.
+#
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# In-process replacement for rgb565/rgb565, converts whole frames at a
+# time. Output is bit-identical to the helper (native endian, channels
+# taken in the order they are given) unless dithering is enabled.
+class pixelformat:
+  # 4x4 Bayer matrix, used as per-pixel threshold for ordered dithering
+  BAYER = [
+    [ 0,  8,  2, 10],
+    [12,  4, 14,  6],
+    [ 3, 11,  1,  9],
+    [15,  7, 13,  5],
+  ]
+
+  _thresholds = {}
+
+  @staticmethod
+  def available():
+    return numpy is not None
+
+  @staticmethod
+  def _threshold(width, height, bits):
+    # Tiles the Bayer matrix over the frame, scaled so it spans exactly one
+    # quantization step. Adding it before truncating keeps the average
+    # intensity intact while spreading the error.
+    key = (width, height, bits)
+    if key not in pixelformat._thresholds:
+      if len(pixelformat._thresholds) > 3:
+        pixelformat._thresholds = {}
+      step = 1 << (8 - bits)
+      matrix = (numpy.array(pixelformat.BAYER, dtype=numpy.uint16) * step) // 16
+      tiles = numpy.tile(matrix, ((height + 3) // 4, (width + 3) // 4))
+      pixelformat._thresholds[key] = tiles[:height, :width]
+    return pixelformat._thresholds[key]
+
+  @staticmethod
+  def toRGB565(data, width, dither=False):
+    # Converts RGB888 data with lines of width pixels into RGB565
+    pixels = numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, width, 3)
+    r = pixels[:, :, 0].astype(numpy.uint16)
+    g = pixels[:, :, 1].astype(numpy.uint16)
+    b = pixels[:, :, 2].astype(numpy.uint16)
+    if dither:
+      height = pixels.shape[0]
+      coarse = pixelformat._threshold(width, height, 5)
+      r = numpy.minimum(r + coarse, 255)
+      g = numpy.minimum(g + pixelformat._threshold(width, height, 6), 255)
+      b = numpy.minimum(b + coarse, 255)
+    result = ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3)
+    return result.astype(numpy.uint16).tobytes()
+
+  @staticmethod
+  def fromRGB565(data):
+    # Converts RGB565 data into RGB888, trailing odd bytes are ignored
+    pixels = numpy.frombuffer(data, dtype=numpy.uint16, count=len(data) // 2).astype(numpy.uint32)
+    result = numpy.empty((pixels.shape[0], 3), dtype=numpy.uint8)
+    result[:, 0] = ((pixels >> 11) & 0x1F) * 255 // 31
+    result[:, 1] = ((pixels >> 5) & 0x3F) * 255 // 63
+    result[:, 2] = (pixels & 0x1F) * 255 // 31
+    return result.tobytes()
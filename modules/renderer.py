@@ -0,0 +1,290 @@
+# This file is part of photoframe (https://github.com/mrworf/photoframe).
+#
+# photoframe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# photoframe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with photoframe.  If not, see <http://www.gnu.org/licenses/>.
+#
+import logging
+import os
+import datetime
+from io import BytesIO
+
+from modules.blur import blur
+from modules.imageheader import imageheader
+
+try:
+  from PIL import Image, ImageDraw, ImageFont
+except ImportError:
+  Image = None
+
+# In-process replacement for the ImageMagick commands used by display,
+# avoids forking convert for every frame. All functions work on RGB
+# images and mimic what the corresponding convert command would do.
+class renderer:
+  FONTS = [
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
+    '/usr/share/fonts/truetype/freefont/FreeSansBold.ttf',
+    '/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf',
+  ]
+
+  # Maps framebuffer format to Pillow raw modes, packing 32bit formats
+  # is done from an opaque RGBA image since ImageMagick sets alpha to 255
+  PACKMODES = {
+    'rgb' : 'RGB',
+    'bgr' : 'BGR',
+    'rgba' : 'RGBA',
+    'bgra' : 'BGRA',
+  }
+  UNPACKMODES = {
+    'rgb' : 'RGB',
+    'bgr' : 'BGR',
+    'rgba' : 'RGBX',
+    'bgra' : 'BGRX',
+  }
+
+  # Largest image we decode, 24 megapixels takes 72MB as RGB
+  MAXPIXELS = 24000000
+
+  _fonts = {}
+
+  @staticmethod
+  def available():
+    return Image is not None
+
+  @staticmethod
+  def load(filename, width=None, height=None):
+    # Only the first frame is used, just like filename[0] with convert.
+    # Given a size, JPEGs are decoded at the smallest scale (down to 1/8)
+    # which still covers it. Images which would decode to more than
+    # MAXPIXELS are refused rather than risking running out of memory.
+    # Photos are turned upright according to their EXIF orientation.
+    info = imageheader.probe(filename)
+    orientation = info['orientation'] if info is not None else 1
+    image = Image.open(filename)
+    if width and height:
+      if imageheader.isRotated(orientation):
+        width, height = height, width
+      scale = max(float(width) / image.size[0], float(height) / image.size[1])
+      if scale < 1.0:
+        image.draft('RGB', (int(image.size[0] * scale + 0.5), int(image.size[1] * scale + 0.5)))
+    if image.size[0] * image.size[1] > renderer.MAXPIXELS:
+      raise ValueError('Image is %dx%d, more than the %d pixels allowed' % (image.size[0], image.size[1], renderer.MAXPIXELS))
+    if image.mode != 'RGB':
+      image = image.convert('RGB')
+    return renderer.upright(image, orientation)
+
+  @staticmethod
+  def upright(image, orientation):
+    # Turns an image with the given EXIF orientation upright
+    transpose = {
+      2 : Image.FLIP_LEFT_RIGHT,
+      3 : Image.ROTATE_180,
+      4 : Image.FLIP_TOP_BOTTOM,
+      5 : Image.TRANSPOSE,
+      6 : Image.ROTATE_270,
+      7 : Image.TRANSVERSE,
+      8 : Image.ROTATE_90,
+    }
+    if orientation in transpose:
+      return image.transpose(transpose[orientation])
+    return image
+
+  @staticmethod
+  def getDate(filename):
+    # Returns when the photo was taken according to EXIF, or None
+    try:
+      exif = Image.open(filename)._getexif()
+      if exif and 36867 in exif:
+        return datetime.datetime.strptime(exif[36867], '%Y:%m:%d %H:%M:%S')
+    except:
+      pass
+    return None
+
+  @staticmethod
+  def fit(image, width, height):
+    # Same as -resize WxH, scales up or down while keeping aspect ratio
+    scale = min(float(width) / image.size[0], float(height) / image.size[1])
+    size = (max(1, int(image.size[0] * scale + 0.5)), max(1, int(image.size[1] * scale + 0.5)))
+    if size == image.size:
+      return image
+    return image.resize(size, Image.BICUBIC)
+
+  @staticmethod
+  def cover(image, width, height):
+    # Same as -resize WxH^ -gravity center -crop WxH+0+0, fills the area
+    # and cuts away what doesn't fit. Cropping first saves resampling it.
+    scale = max(float(width) / image.size[0], float(height) / image.size[1])
+    w, h = width / scale, height / scale
+    left, top = (image.size[0] - w) / 2, (image.size[1] - h) / 2
+    box = (int(left), int(top), int(round(left + w)), int(round(top + h)))
+    return image.crop(box).resize((width, height), Image.BICUBIC)
+
+  @staticmethod
+  def reframe(image, width, height, mode):
+    # Same as helper.makeFullframe(), mode is blur, zoom or auto. Images
+    # which already fill the screen are returned as-is.
+    if mode not in ['blur', 'zoom', 'auto']:
+      return image
+    ar = float(image.size[0]) / image.size[1]
+    if image.size[0] > width:
+      adjWidth, adjHeight = width, int(width / ar)
+    else:
+      adjWidth, adjHeight = int(height * ar), height
+
+    border = 15
+    spacing = 3
+    if adjHeight < height:
+      padding = (height - adjHeight) / 2 - border
+      frame = (0, border + spacing)
+    elif adjWidth < width:
+      padding = (width - adjWidth) / 2 - border
+      frame = (border + spacing, 0)
+    else:
+      return image
+
+    if mode == 'zoom' or (mode == 'auto' and padding < 60):
+      return renderer.cover(image, width, height)
+
+    # Darkened and blurred version filling the screen, with the image
+    # (and a black frame) on top
+    background = blur.background(image, width, height, 12, 0.8)
+    framed = Image.new('RGB', (image.size[0] + 2 * frame[0], image.size[1] + 2 * frame[1]), (0, 0, 0))
+    framed.paste(image, frame)
+    framed = renderer.fit(framed, width, height)
+    background.paste(framed, ((width - framed.size[0]) // 2, (height - framed.size[1]) // 2))
+    return background
+
+  @staticmethod
+  def rotate(image, degrees):
+    # Same as -rotate for multiples of 90, clockwise
+    degrees = degrees % 360
+    if degrees == 90:
+      return image.transpose(Image.ROTATE_270)
+    elif degrees == 180:
+      return image.transpose(Image.ROTATE_180)
+    elif degrees == 270:
+      return image.transpose(Image.ROTATE_90)
+    return image
+
+  @staticmethod
+  def extent(image, width, height, xoffset=0, yoffset=0):
+    # Same as -background black -gravity center -extent WxH+X+Y, including
+    # how ImageMagick places the image when an offset is given
+    canvas = Image.new('RGB', (width, height), (0, 0, 0))
+    left = width // 2 - image.size[0] // 2 - xoffset
+    top = height // 2 - image.size[1] // 2 - yoffset
+    canvas.paste(image, (left, top))
+    return canvas
+
+  @staticmethod
+  def _font(size):
+    if size not in renderer._fonts:
+      font = None
+      for name in renderer.FONTS:
+        if os.path.exists(name):
+          font = ImageFont.truetype(name, size)
+          break
+      if font is None:
+        logging.warning('No TrueType font found, text will be tiny')
+        font = ImageFont.load_default()
+      renderer._fonts[size] = font
+    return renderer._fonts[size]
+
+  @staticmethod
+  def _textWidth(font, text):
+    if hasattr(font, 'getlength'):
+      return font.getlength(text)
+    return font.getsize(text)[0]
+
+  @staticmethod
+  def _wrap(font, text, width):
+    # Word wraps like caption: does, keeping explicit line breaks
+    lines = []
+    for paragraph in text.split('\n'):
+      line = ''
+      for word in paragraph.split(' '):
+        proposed = word if line == '' else line + ' ' + word
+        if line != '' and renderer._textWidth(font, proposed) > width:
+          lines.append(line)
+          line = word
+        else:
+          line = proposed
+      lines.append(line)
+    return lines
+
+  @staticmethod
+  def _drawText(draw, font, lines, width, top, fill):
+    ascent, descent = font.getmetrics()
+    for line in lines:
+      left = (width - renderer._textWidth(font, line)) / 2
+      draw.text((left, top), line, font=font, fill=fill)
+      top += ascent + descent
+    return top
+
+  @staticmethod
+  def caption(message, footer, width, height, pointsize=32):
+    # White text centered on black with a grey footer, see display.message
+    image = Image.new('RGB', (width, height), (0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    font = renderer._font(pointsize)
+    ascent, descent = font.getmetrics()
+
+    lines = renderer._wrap(font, message, width)
+    renderer._drawText(draw, font, lines, width, (height - len(lines) * (ascent + descent)) / 2, (255, 255, 255))
+    lines = renderer._wrap(font, footer, width)
+    renderer._drawText(draw, font, lines, width, height - len(lines) * (ascent + descent), (0x66, 0x66, 0x66))
+    return image
+
+  @staticmethod
+  def label(text, pointsize=28):
+    # White text on a translucent black box, returns an RGBA image
+    font = renderer._font(pointsize)
+    ascent, descent = font.getmetrics()
+    lines = text.split('\n')
+    padding = pointsize // 3
+    width = int(max([renderer._textWidth(font, x) for x in lines])) + 2 * padding
+    height = len(lines) * (ascent + descent) + 2 * padding
+    image = Image.new('RGBA', (width, height), (0, 0, 0, 160))
+    draw = ImageDraw.Draw(image)
+    top = padding
+    for line in lines:
+      draw.text((padding, top), line, font=font, fill=(255, 255, 255, 255))
+      top += ascent + descent
+    return image
+
+  @staticmethod
+  def pack(image, format):
+    # Returns raw framebuffer data in the requested format
+    if len(format) == 4:
+      image = image.convert('RGBA')
+    return image.tobytes('raw', renderer.PACKMODES[format])
+
+  @staticmethod
+  def unpack(data, width, height, format):
+    return Image.frombytes('RGB', (width, height), data, 'raw', renderer.UNPACKMODES[format])
+
+  @staticmethod
+  def encode(image, format='JPEG'):
+    output = BytesIO()
+    image.save(output, format)
+    return output.getvalue()
+
+  @staticmethod
+  def shrink(data, width, format='JPEG'):
+    # Scales an encoded image down to width, keeping the aspect ratio.
+    # JPEGs are decoded at reduced size when possible.
+    image = Image.open(BytesIO(data))
+    if image.size[0] > width:
+      height = max(1, image.size[1] * width // image.size[0])
+      image.draft('RGB', (width, height))
+      image = image.convert('RGB').resize((width, height), Image.BILINEAR)
+    return renderer.encode(image, format)
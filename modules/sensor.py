@@ -0,0 +1,151 @@
+# This file is part of photoframe (https://github.com/mrworf/photoframe).
+#
+# photoframe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# photoframe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with photoframe.  If not, see <http://www.gnu.org/licenses/>.
+#
+import logging
+import time
+
+try:
+  import smbus
+except ImportError:
+  smbus = None
+
+# Ambient light sensors used by colormatch. A sensor delivers raw red,
+# green, blue and clear counts, and is also the clock colormatch paces
+# its readings by, which lets a recorded trace be played back faster
+# than real time.
+class sensor:
+  name = 'none'
+
+  def open(self):
+    # Returns True if the sensor is present and ready
+    return False
+
+  def read(self):
+    # Returns (red, green, blue, clear) or None when there are no more
+    # readings
+    return None
+
+  def time(self):
+    return time.time()
+
+  def sleep(self, seconds):
+    time.sleep(seconds)
+
+# Adafruit TCS34725 breakout on I2C bus 1
+class tcs34725(sensor):
+  name = 'TCS34725'
+  ADDRESS = 0x29
+
+  def __init__(self, bus=1):
+    self.busNumber = bus
+    self.bus = None
+
+  # This function is mostly based of the example provided by Brad Berkland's blog:
+  # http://bradsrpi.blogspot.com/2013/05/tcs34725-rgb-color-sensor-raspberry-pi.html
+  #
+  def open(self):
+    if smbus is None:
+      logging.info('No SMB subsystem, color sensor unavailable')
+      return False
+    try:
+      self.bus = smbus.SMBus(self.busNumber)
+    except:
+      logging.info('No SMB subsystem, color sensor unavailable')
+      return False
+    # Register 0x12 has device ver.
+    # Register addresses must be OR'ed with 0x80
+    try:
+      self.bus.write_byte(tcs34725.ADDRESS, 0x80|0x12)
+    except:
+      logging.info('ColorSensor not available')
+      return False
+    ver = self.bus.read_byte(tcs34725.ADDRESS)
+    # version # should be 0x44
+    if ver != 0x44:
+      logging.info('No TCS34725 color sensor detected, will not compensate for ambient color temperature')
+      return False
+
+    self.bus.write_byte(tcs34725.ADDRESS, 0x80|0x00) # 0x00 = ENABLE register
+    self.bus.write_byte(tcs34725.ADDRESS, 0x01|0x02) # 0x01 = Power on, 0x02 RGB sensors enabled
+    self.bus.write_byte(tcs34725.ADDRESS, 0x80|0x14) # Reading results start register 14, LSB then MSB
+    return True
+
+  def read(self):
+    data = self.bus.read_i2c_block_data(tcs34725.ADDRESS, 0)
+    clear = data[1] << 8 | data[0]
+    red = data[3] << 8 | data[2]
+    green = data[5] << 8 | data[4]
+    blue = data[7] << 8 | data[6]
+    return (red, green, blue, clear)
+
+# Plays back a recorded trace, one reading per line as
+#
+#   seconds,red,green,blue,clear
+#
+# where seconds is relative to the start of the recording. Time is
+# simulated, sleep() moves it forward and only waits for real when a
+# speed is given (2 being twice as fast as recorded). Each reading is
+# returned for as long as it's the latest one.
+class replay(sensor):
+  name = 'replay'
+
+  def __init__(self, filename, speed=None):
+    self.filename = filename
+    self.speed = speed
+    self.readings = []
+    self.index = 0
+    self.now = 0
+    self.listeners = []
+
+  def addClockListener(self, listener):
+    # listener() is called every time the simulated clock moves
+    self.listeners.append(listener)
+
+  def open(self):
+    try:
+      with open(self.filename, 'r') as f:
+        for line in f:
+          line = line.strip()
+          if line == '' or line.startswith('#'):
+            continue
+          values = [float(x) for x in line.split(',')]
+          self.readings.append((values[0], tuple(values[1:5])))
+    except (IOError, ValueError, IndexError):
+      logging.exception('Unable to load trace from %s', self.filename)
+      return False
+    if len(self.readings) == 0:
+      logging.error('Trace %s has no readings', self.filename)
+      return False
+    self.readings.sort(key=lambda x: x[0])
+    self.now = self.readings[0][0]
+    self.index = 0
+    return True
+
+  def read(self):
+    if self.now > self.readings[-1][0]:
+      return None
+    while self.index + 1 < len(self.readings) and self.readings[self.index + 1][0] <= self.now:
+      self.index += 1
+    return self.readings[self.index][1]
+
+  def time(self):
+    return self.now
+
+  def sleep(self, seconds):
+    self.now += seconds
+    if self.speed:
+      time.sleep(seconds / float(self.speed))
+    for listener in self.listeners:
+      listener()
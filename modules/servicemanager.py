@@ -277,12 +277,18 @@ class ServiceManager:
       })
     return result
 
-  def servicePrepareNextItem(self, id, destinationFile, supportedMimeTypes, displaySize):
+  def servicePrepareNextItem(self, id, destinationFile, supportedMimeTypes, displaySize, isCached=None):
     if id not in self._SERVICES:
-      return {'error' : 'Service not available', 'mime' : None, 'source' : None}
+      return {'error' : 'Service not available', 'mime' : None, 'source' : None, 'id' : None, 'cached' : False}
 
     svc = self._SERVICES[id]['service']
-    return svc.prepareNextItem(destinationFile, supportedMimeTypes, displaySize)
+    result = svc.prepareNextItem(destinationFile, supportedMimeTypes, displaySize, isCached)
+    # Not all services provide the optional fields
+    if 'id' not in result:
+      result['id'] = None
+    if 'cached' not in result:
+      result['cached'] = False
+    return result
 
   def hasKeywords(self):
     # Check any and all services to see if any is ready and if they have keywords
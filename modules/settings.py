@@ -66,6 +66,17 @@ class settings:
 			'display-special' : None,
 			'imagesizing' : 'blur',
 			"orientation" : 'both',
+			'rotation' : 0,						# Clockwise, 0, 90, 180 or 270
+			'prefetch' : 2,						# How many images to download and process ahead of time
+			'cache-size' : 512,				# How many MB of rendered images to keep on disk (0 = none)
+			'renderer' : 'auto',			# auto, pillow or imagemagick
+			'dither' : 0,						# Ordered dithering on 16bit displays, 0 or 1 (needs NumPy)
+			'transition' : 'none',		# none, crossfade or wipe (needs NumPy)
+			'transition-duration' : 1.0,	# Seconds
+			'transition-fps' : 15,
+			'kenburns-fps' : 8,				# Upper limit, lowered automatically on slow boards
+			'overlay-clock' : 0,				# Show the time in the corner, 0 or 1
+			'overlay-caption' : 0,			# Show when the photo was taken, 0 or 1
 		}
 
 	def load(self):
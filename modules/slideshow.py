@@ -24,12 +24,28 @@ import json
 import math
 import re
 import subprocess
+import Queue
 
 from modules.remember import remember
 from modules.helper import helper
+from modules.timing import timing
+from modules.whitebalance import whitebalance
+from modules.kenburns import kenburns
+from modules.renderer import renderer
 
 class slideshow:
   SHOWN_IP = False
+  SUPPORTED_FORMATS = [
+    'image/jpeg',
+    'image/png',
+    'image/gif',
+    'image/bmp'
+    # HEIF to be added once I get ImageMagick running with support
+  ]
+
+  # How far (in Kelvin) the ambient light has to move before the photo
+  # on screen is tinted again
+  HYSTERESIS = 200
 
   def __init__(self, display, settings, colormatch):
     self.queryPowerFunc = None
@@ -40,9 +56,30 @@ class slideshow:
     self.imageCurrent = None
     self.imageMime = None
     self.services = None
+    self.cache = None
     self.void = open(os.devnull, 'wb')
     self.delayer = threading.Event()
 
+    # Items are prepared ahead of time by a producer thread, the
+    # generation is bumped whenever queued items become stale
+    self.prefetchQueue = Queue.Queue(1)
+    self.prefetchLock = threading.Lock()
+    self.prefetchCount = 0
+    self.generation = 0
+    self.producer = None
+
+    # Set when services fail and we're showing frames from the cache
+    self.offline = False
+    self.timing = timing()
+    self.kenburns = kenburns()
+    self.overlay = None
+
+    # The untinted frame on screen and the temperature it's tinted to,
+    # None unless it can follow the ambient light
+    self.tintLock = threading.Lock()
+    self.shown = None
+    self.colormatch.addUpdateListener(self._ambientChanged)
+
   def getCurrentImage(self):
     return self.imageCurrent, self.imageMime
 
@@ -52,9 +89,18 @@ class slideshow:
       'lux':self.colormatch.getLux()
       }
 
+  def getTimingInformation(self):
+    return self.timing.getStatistics()
+
+  def setOverlay(self, overlay):
+    self.overlay = overlay
+
   def setServiceManager(self, services):
     self.services = services
 
+  def setFrameCache(self, cache):
+    self.cache = cache
+
   def setQueryPower(self, func):
     self.queryPowerFunc = func
 
@@ -69,93 +115,407 @@ class slideshow:
 
   def trigger(self):
     logging.debug('Causing immediate showing of image')
+    with self.prefetchLock:
+      self.generation += 1
     self.delayer.set()
 
+  def _getPrefetchDepth(self):
+    depth = self.settings.getUser('prefetch')
+    if type(depth) != int or depth < 1:
+      logging.warning('Invalid prefetch depth %s, using 1', repr(depth))
+      depth = 1
+    return depth
+
+  def _discardItem(self, item):
+    if item['filename'] is not None and os.path.exists(item['filename']):
+      os.remove(item['filename'])
+
+  def _flushQueue(self):
+    with self.prefetchLock:
+      old = self.prefetchQueue
+      self.prefetchQueue = Queue.Queue(self._getPrefetchDepth())
+    while True:
+      try:
+        self._discardItem(old.get_nowait())
+      except Queue.Empty:
+        break
+
+  def _prepareItem(self, useService):
+    # Fetches and processes the next item, returns the item and which
+    # service to use next time around
+    item = {'filename' : None, 'mimetype' : None, 'message' : None, 'frame' : None, 'animation' : None, 'caption' : None, 'offline' : False, 'retint' : False, 'timing' : {}, 'memory' : None}
+    stamp = time.time()
+
+    services = self.services.getServices(readyOnly=True)
+    if len(services) == 0:
+      item['message'] = 'Photoframe isn\'t ready yet\n\nPlease direct your webbrowser to\n\nhttp://%s:7777/\n\nand add one or more photo providers' % self.settings.get('local-ip')
+      return item, useService
+
+    # Very simple round-robin
+    if useService >= len(services):
+      useService = 0
+    svc = services[useService]['id']
+    item['timing']['select'], stamp = self._lap(stamp)
+
+    # Frames are cached per display setup, the key also holds the color
+    # temperature since the adjustment is baked into the frame
+    imagesizing = self.settings.getUser('imagesizing')
+    if imagesizing == 'kenburns' and not kenburns.available():
+      logging.warning('Pillow is not installed, cannot pan and zoom')
+      imagesizing = 'zoom'
+    group = repr((self.display.getSignature(), imagesizing, self.settings.getUser('orientation')))
+    # With NumPy, still frames are prepared (and cached) untinted and
+    # adjusted to the ambient light as they're shown. Otherwise, and for
+    # animations, the image is adjusted while being prepared, which
+    # works as long as it is done in memory.
+    inMemory = self.display.usesPillow()
+    # Animations aren't cached, only their first frame would be
+    animate = imagesizing == 'kenburns'
+    item['retint'] = whitebalance.available() and not animate
+    temperature = None
+    if not item['retint'] and (inMemory or animate):
+      temperature = self.colormatch.getTemperatureBucket()
+    isCached = None
+    if self.cache is not None and self.cache.isEnabled() and not animate:
+      isCached = lambda itemId: itemId is not None and self.cache.has(group, repr((svc, itemId, temperature)))
+
+    # Each item needs its own file since several can be queued
+    self.prefetchCount += 1
+    filename = os.path.join(self.settings.get('tempfolder'), 'image-%d' % self.prefetchCount)
+    try:
+      result = self.services.servicePrepareNextItem(svc, filename, slideshow.SUPPORTED_FORMATS, {'width' : self.settings.getUser('width'), 'height' : self.settings.getUser('height'), "orientation": self.settings.getUser("orientation")}, isCached)
+    except:
+      # Typically happens when the network is down
+      logging.exception('Service failed to prepare next item')
+      result = {'error' : 'Unable to download next image', 'id' : None, 'cached' : False}
+    item['timing']['fetch'], stamp = self._lap(stamp)
+
+    if result['error'] is not None:
+      if os.path.exists(filename):
+        os.remove(filename)
+
+      # Keep the frame alive with what we already have, the service is
+      # tried again when the next item is prepared
+      entry = None
+      if self.cache is not None:
+        entry = self.cache.pick(group)
+      if entry is not None:
+        if not self.offline:
+          logging.warning('%s failed (%s), showing cached images until it recovers', services[useService]['name'], result['error'])
+          self.offline = True
+        item['frame'] = {'signature' : self.display.getSignature(), 'data' : entry['data']}
+        item['caption'] = entry['caption']
+        item['offline'] = True
+      else:
+        item['message'] = '%s failed:\n\n%s' % (services[useService]['name'], result['error'])
+      return item, useService + 1
+
+    if self.offline:
+      logging.info('%s has recovered, leaving offline mode', services[useService]['name'])
+      self.offline = False
+
+    if result['cached']:
+      item['mimetype'] = result['mimetype']
+      entry = self.cache.get(group, repr((svc, result['id'], temperature)))
+      if entry is None:
+        logging.warning('Cached frame disappeared before it could be used')
+      else:
+        logging.debug('Using cached frame for %s', result['id'])
+        item['frame'] = {'signature' : self.display.getSignature(), 'data' : entry['data']}
+        item['caption'] = entry['caption']
+    else:
+      item['filename'] = filename
+      item['mimetype'] = result['mimetype']
+      # Kept with the frame in the cache, whether it's shown is decided
+      # when the item is shown
+      if self.overlay is not None and renderer.available():
+        taken = renderer.getDate(filename)
+        if taken is not None:
+          item['caption'] = taken.strftime('%d %B %Y')
+
+      timing.resetPeak()
+      if inMemory:
+        stamp = self._processInMemory(item, filename, imagesizing, temperature, stamp)
+      else:
+        stamp = self._processFile(item, filename, imagesizing, temperature, stamp)
+      item['memory'] = timing.getPeak()
+      if item['animation'] is None and item['frame'] is not None and result['id'] is not None and self.cache is not None and self.cache.isEnabled():
+        self.cache.put(group, repr((svc, result['id'], temperature)), item['frame']['data'], item['caption'])
+    return item, useService + 1
+
+  def _processFile(self, item, filename, imagesizing, temperature, stamp):
+    # Reframes and adjusts the image on disk, one tool after the other
+    if imagesizing in ['blur', 'zoom', 'auto']:
+      imageSize = helper.getImageSize(filename)
+      item['timing']['identify'], stamp = self._lap(stamp)
+      if imageSize is not None:
+        helper.makeFullframe(filename, self.settings.getUser('width'), self.settings.getUser('height'), zoomOnly=(imagesizing == 'zoom'), autoChoose=(imagesizing == 'auto'), imageSize=imageSize)
+        item['timing']['reframe'], stamp = self._lap(stamp)
+    if imagesizing == 'kenburns':
+      item['animation'] = self._prepareAnimation(filename, temperature)
+      if item['animation'] is not None:
+        item['frame'] = self.display.prepareImage(self.kenburns.render(item['animation'], 0))
+        item['timing']['convert'], stamp = self._lap(stamp)
+        return stamp
+
+    # Convert into framebuffer format now, so showing it is just a copy
+    item['frame'] = self.display.prepare(filename)
+    item['timing']['convert'], stamp = self._lap(stamp)
+    return stamp
+
+  def _processInMemory(self, item, filename, imagesizing, temperature, stamp):
+    # Decodes the image once, then reframes, adjusts and packs it in
+    # memory. The file is left as downloaded.
+    width, height = self.settings.getUser('width'), self.settings.getUser('height')
+    # Never decode more than needed, pan and zoom needs some extra
+    margin = kenburns.ZOOM if imagesizing == 'kenburns' else 1.0
+    try:
+      image = renderer.load(filename, int(width * margin), int(height * margin))
+    except:
+      logging.exception('Unable to decode %s', filename)
+      return stamp
+    item['timing']['decode'], stamp = self._lap(stamp)
+
+    if imagesizing in ['blur', 'zoom', 'auto']:
+      image = renderer.reframe(image, width, height, imagesizing)
+      item['timing']['reframe'], stamp = self._lap(stamp)
+    if temperature is not None:
+      image = whitebalance.adjustImage(image, temperature)
+      item['timing']['colour'], stamp = self._lap(stamp)
+
+    if imagesizing == 'kenburns':
+      item['animation'] = self._prepareAnimation(image)
+      if item['animation'] is not None:
+        image = self.kenburns.render(item['animation'], 0)
+
+    item['frame'] = self.display.prepareImage(renderer.fit(image, width, height))
+    item['timing']['convert'], stamp = self._lap(stamp)
+    return stamp
+
+  def _prepareAnimation(self, source, temperature=None):
+    # Returns the pan and zoom animation for source (see kenburns.load),
+    # None if it can't be done, in which case the image is shown as-is.
+    # The source is adjusted to temperature unless it's None.
+    fps = self.settings.getUser('kenburns-fps')
+    if fps != self.kenburns.fps:
+      self.kenburns.setFramerate(fps)
+    try:
+      animation = self.kenburns.load(source, self.settings.getUser('width'), self.settings.getUser('height'), self.settings.getUser('interval'))
+    except:
+      logging.exception('Unable to prepare pan and zoom')
+      return None
+    if temperature is not None:
+      animation['source'] = whitebalance.adjustImage(animation['source'], temperature)
+    return animation
+
+  def _tint(self, frame, temperature):
+    # Remembers frame as the one on screen and returns it adjusted to
+    # temperature, None leaves it untouched
+    self.shown = {'frame' : frame, 'temperature' : temperature}
+    if temperature is None:
+      return frame
+    format, depth = self.display.getPixelFormat()
+    return {'signature' : frame['signature'], 'data' : whitebalance.adjustFrame(frame['data'], format, depth, temperature)}
+
+  def _ambientChanged(self, temperature, lux):
+    # Called by colormatch when the light has changed, tints the photo on
+    # screen again once it has changed enough. If a new frame is being
+    # shown it will be tinted anyway, so don't wait for it.
+    if not self.tintLock.acquire(False):
+      return
+    try:
+      if self.shown is None:
+        return
+      bucket = self.colormatch.getTemperatureBucket()
+      current = self.shown['temperature']
+      if bucket == current:
+        return
+      if bucket is not None and current is not None and abs(bucket - current) < slideshow.HYSTERESIS:
+        return
+      logging.debug('Ambient light changed from %s to %sK, tinting photo again', current, bucket)
+      self.display.show(self._tint(self.shown['frame'], bucket), 0)
+    finally:
+      self.tintLock.release()
+
+  def _lap(self, stamp):
+    # Returns time spent since stamp and a new stamp
+    now = time.time()
+    return now - stamp, now
+
+  def _recordTiming(self, item):
+    # Adds the stages of a shown item to the statistics, logs the
+    # breakdown if it took longer than the interval
+    total = 0
+    for stage in item['timing']:
+      self.timing.record(stage, item['timing'][stage])
+      total += item['timing'][stage]
+    self.timing.record('total', total)
+    if item.get('memory') is not None:
+      self.timing.record(timing.MEMORY, item['memory'])
+
+    interval = self.settings.getUser('interval')
+    if total > interval:
+      details = ', '.join(['%s %.2fs' % (x, item['timing'][x]) for x in sorted(item['timing'], key=lambda k: -item['timing'][k])])
+      logging.warning('Preparing and showing image took %.2fs which is longer than interval of %ds (%s)', total, interval, details)
+
+  def prefetch(self, stop):
+    # Producer, keeps the queue filled with ready-to-show items until
+    # the presentation tells it to stop
+    useService = 0
+    while not stop.is_set():
+      generation = self.generation
+      try:
+        item, useService = self._prepareItem(useService)
+      except:
+        logging.exception('Failed to prepare next item')
+        item = {'filename' : None, 'mimetype' : None, 'message' : 'Unable to prepare next image\n\nCheck logs for details', 'frame' : None, 'animation' : None, 'caption' : None, 'offline' : False, 'retint' : False, 'timing' : {}, 'memory' : None}
+        useService += 1
+      item['generation'] = generation
+
+      queued = False
+      while not queued and not stop.is_set():
+        with self.prefetchLock:
+          if generation != self.generation:
+            break
+          try:
+            self.prefetchQueue.put_nowait(item)
+            queued = True
+          except Queue.Full:
+            pass
+        if not queued:
+          stop.wait(0.5)
+      if not queued:
+        self._discardItem(item)
+    logging.debug('Prefetching has stopped')
+
+  def _nextItem(self):
+    # Blocks until an item for the current generation is available,
+    # returns None if the display was turned off while waiting
+    while self.queryPowerFunc is None or self.queryPowerFunc() is not False:
+      try:
+        item = self.prefetchQueue.get(True, 1)
+      except Queue.Empty:
+        continue
+      if item['generation'] == self.generation:
+        return item
+      self._discardItem(item)
+    return None
+
   def presentation(self):
     self.services.getServices(readyOnly=True)
 
+    # The producer of the last presentation may still be busy with an
+    # item, there must never be two of them
+    if self.producer is not None:
+      self.producer.join()
+
+    # Start preparing items right away, so the first one is
+    # ready when we're done with the countdown
+    self._flushQueue()
+    stop = threading.Event()
+    self.producer = threading.Thread(target=self.prefetch, args=(stop,))
+    self.producer.daemon = True
+    self.producer.start()
+
     if not slideshow.SHOWN_IP:
       slideshow.SHOWN_IP = True
-      # Once we have IP, show for 10s
-      cd = 10
-      while (cd > 0):
-        self.display.message('Starting in %d seconds' % (cd))
-        cd -= 1
-        time.sleep(1)
+      # Once we have IP, show for 10s. The countdown is rendered in the
+      # background and paced by the clock, so slow renders can't stretch it
+      countdown = ['Starting in %d seconds' % (cd) for cd in range(10, 0, -1)]
+      prerender = threading.Thread(target=self.display.prerender, args=(countdown,))
+      prerender.daemon = True
+      prerender.start()
+      start = time.time()
+      step = 0
+      while step < len(countdown):
+        self.display.message(countdown[step])
+        step = int(time.time() - start) + 1
+        time.sleep(max(0, start + step - time.time()))
       self.display.clear()
 
-
     logging.info('Starting presentation')
     delay = 0
-    useService = 0
-    supportedFormats = [
-      'image/jpeg',
-      'image/png',
-      'image/gif',
-      'image/bmp'
-      # HEIF to be added once I get ImageMagick running with support
-    ]
+    shown = time.time()
 
     self.delayer.clear()
     imageOnScreen = False
+    animation = None
     while True:
       # Avoid showing images if the display is off
       if self.queryPowerFunc is not None and self.queryPowerFunc() is False:
         logging.info("Display is off, exit quietly")
         break
 
-      # For now, just pick the first service
-      time_process = time.time()
-
-      services = self.services.getServices(readyOnly=True)
-      if len(services) > 0:
-        # Very simple round-robin
-        if useService >= len(services):
-          useService = 0
-        svc = services[useService]['id']
-
-        filename = os.path.join(self.settings.get('tempfolder'), 'image')
-        result = self.services.servicePrepareNextItem(svc, filename, supportedFormats, {'width' : self.settings.getUser('width'), 'height' : self.settings.getUser('height'), "orientation": self.settings.getUser("orientation")})
-        if result['error'] is not None:
-          self.display.message('%s failed:\n\n%s' % (services[useService]['name'], result['error']))
-        else:
-          self.imageMime = result['mimetype']
-          self.imageCurrent = filename
-
-          if self.settings.getUser('imagesizing') == 'blur':
-            helper.makeFullframe(filename, self.settings.getUser('width'), self.settings.getUser('height'))
-          elif self.settings.getUser('imagesizing') == 'zoom':
-            helper.makeFullframe(filename, self.settings.getUser('width'), self.settings.getUser('height'), zoomOnly=True)
-          elif self.settings.getUser('imagesizing') == 'auto':
-            helper.makeFullframe(filename, self.settings.getUser('width'), self.settings.getUser('height'), autoChoose=True)
-          if self.colormatch.hasSensor():
-            if not self.colormatch.adjust(filename):
-              logging.warning('Unable to adjust image to colormatch, using original')
-        useService += 1
+      # Delay before we show the next item, prefetching means we
+      # shouldn't have to take processing time into account
+      remaining = max(0, delay - (time.time() - shown))
+      if animation is not None:
+        triggered = self.kenburns.run(animation, remaining, self.display.draw, self.delayer.wait)
+        animation = None
       else:
-        self.display.message('Photoframe isn\'t ready yet\n\nPlease direct your webbrowser to\n\nhttp://%s:7777/\n\nand add one or more photo providers' % self.settings.get('local-ip'))
-
-      time_process = time.time() - time_process
-
-      # Delay before we show the image (but take processing into account)
-      # This should keep us fairly consistent
-      if time_process < delay and (imageOnScreen or self.imageCurrent is None):
-        triggered = self.delayer.wait(delay - time_process)
-        self.delayer.clear()
-        if triggered:
-          logging.info('Change of configuration, flush data and restart')
-          # We need to expunge any pending image now
-          # so we get fresh data to show the user
-          if self.imageCurrent:
-            os.remove(self.imageCurrent)
-            self.imageCurrent = None
-            imageOnScreen = False
+        triggered = self.delayer.wait(remaining)
+      self.delayer.clear()
+      if triggered:
+        logging.info('Change of configuration, flush data and restart')
+        # We need to expunge any pending items now
+        # so we get fresh data to show the user
+        self._flushQueue()
+        if imageOnScreen:
+          self.imageCurrent = None
+          imageOnScreen = False
+          with self.tintLock:
+            self.shown = None
             self.display.clear()
 
-      if self.imageCurrent is not None and os.path.exists(self.imageCurrent):
-        self.display.image(self.imageCurrent)
-        os.remove(self.imageCurrent)
-        imageOnScreen = True
+      item = self._nextItem()
+      if item is None:
+        continue
+
+      if item['frame'] is not None:
+        self.imageMime = item['mimetype']
+        self.imageCurrent = item['filename']
+        stamp = time.time()
+        if self.overlay is not None:
+          # Drawn into the frame as it's shown
+          self.overlay.setCaption(item['caption'] if self.settings.getUser('overlay-caption') else None, False)
+          self.overlay.setStatus('Offline' if item['offline'] else None, False)
+        with self.tintLock:
+          frame = item['frame']
+          self.shown = None
+          if item['retint']:
+            # Frames are tinted as they're shown, which counts as colour
+            # rather than write
+            tinting = time.time()
+            frame = self._tint(frame, self.colormatch.getTemperatureBucket())
+            item['timing']['colour'] = time.time() - tinting
+            stamp += item['timing']['colour']
+          # Transitions may use at most half of the time the image is shown
+          onScreen = self.display.show(frame, self.settings.getUser('interval') / 2.0)
+          if not onScreen:
+            self.shown = None
+        if onScreen:
+          imageOnScreen = True
+          animation = item['animation']
+          item['timing']['write'] = time.time() - stamp
+          self._recordTiming(item)
+        self._discardItem(item)
+      elif item['message'] is not None:
+        if self.overlay is not None:
+          self.overlay.setCaption(None, False)
+          self.overlay.setStatus(None, False)
+        with self.tintLock:
+          self.shown = None
+          self.display.message(item['message'])
+      else:
+        logging.warning('Nothing to show for this item, skipping it')
+        self._discardItem(item)
+        continue
+      shown = time.time()
 
       delay = self.settings.getUser('interval')
+
+    with self.tintLock:
+      self.shown = None
+    stop.set()
+    self._flushQueue()
     self.thread = None
@@ -0,0 +1,40 @@
+# This file is part of photoframe (https://github.com/mrworf/photoframe).
+#
+# photoframe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# photoframe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with photoframe.  If not, see <http://www.gnu.org/licenses/>.
+#
+from collections import deque
+
+# Filters a noisy series of readings. The median of the last few readings
+# throws away single spikes, and a moving average of those medians evens
+# out the rest.
+class smoothing:
+  def __init__(self, size=5, weight=0.3):
+    self.readings = deque(maxlen=size)
+    self.weight = weight
+    self.value = None
+
+  def reset(self):
+    self.readings.clear()
+    self.value = None
+
+  def add(self, reading):
+    # Returns the filtered value including reading
+    self.readings.append(reading)
+    ordered = sorted(self.readings)
+    median = ordered[len(ordered) // 2]
+    if self.value is None:
+      self.value = median
+    else:
+      self.value += (median - self.value) * self.weight
+    return self.value
@@ -14,14 +14,16 @@
 # along with photoframe.  If not, see <http://www.gnu.org/licenses/>.
 #
 import logging
-from threading import Thread
+from threading import Thread, Event, Lock
 import time
 
-# Start timer for keeping display on/off
+# Start timer for keeping display on/off. Time is taken from clock, which
+# may be a replayed sensor (see modules/sensor.py) when simulating.
 class timekeeper(Thread):
-	def __init__(self, cbPower, cbSlideshow):
+	def __init__(self, cbPower, cbSlideshow, clock = time):
 		Thread.__init__(self)
 		self.daemon = True
+		self.clock = clock
 		self.scheduleOff = False
 		self.ambientOff = False
 		self.standby = False
@@ -36,6 +38,10 @@ class timekeeper(Thread):
 		self.luxHigh = None
 		self.cbPower = cbPower
 		self.cbSlideshow = cbSlideshow
+		# The sensor only reports changes, so lux timeouts are also checked
+		# from our own thread
+		self.wakeup = Event()
+		self.ambientLock = Lock()
 		self.start()
 
 	def setConfiguration(self, hourOn, hourOff):
@@ -77,20 +83,35 @@ class timekeeper(Thread):
 		if self.luxLimit is None or self.luxTimeout is None:
 			return
 		if lux < self.luxLimit and self.luxLow is None:
-			self.luxLow = time.time() + self.luxTimeout * 60
+			self.luxLow = self.clock.time() + self.luxTimeout * 60
 			self.luxHigh = None
+			self.wakeup.set()
 		elif lux >= self.luxLimit and self.luxLow is not None:
 			self.luxLow = None
-			self.luxHigh = time.time() + self.luxTimeout * 60
+			self.luxHigh = self.clock.time() + self.luxTimeout * 60
+			self.wakeup.set()
+		self.evaluateAmbient()
 
-		previously = self.ambientOff
-		if not self.standby and self.luxLow and time.time() > self.luxLow:
-			self.ambientOff = True
-		elif self.standby and self.luxHigh and time.time() > self.luxHigh:
-			self.ambientOff = False
-		if previously != self.ambientOff:
-			logging.debug('Ambient power state has changed: %s', repr(self.ambientOff))
-			self.evaluatePower()
+	def evaluateAmbient(self):
+		# Turns the display off (or on) once the light has been below (or
+		# above) the limit for long enough
+		with self.ambientLock:
+			previously = self.ambientOff
+			if not self.standby and self.luxLow and self.clock.time() > self.luxLow:
+				self.ambientOff = True
+			elif self.standby and self.luxHigh and self.clock.time() > self.luxHigh:
+				self.ambientOff = False
+			if previously != self.ambientOff:
+				logging.debug('Ambient power state has changed: %s', repr(self.ambientOff))
+				self.evaluatePower()
+
+	def _nextWakeup(self):
+		# Seconds until the schedule or a lux timeout needs a look
+		delay = 60 # every minute
+		for deadline in [self.luxLow, self.luxHigh]:
+			if deadline is not None:
+				delay = min(delay, max(0, deadline - self.clock.time()) + 0.1)
+		return delay
 
 	def evaluatePower(self):
 		# Either source can turn off display but scheduleOff takes priority on power on
@@ -105,27 +126,29 @@ class timekeeper(Thread):
 
 	def run(self):
 		while True:
-			time.sleep(60) # every minute
-
-			scheduleOff = False
+			self.wakeup.wait(self._nextWakeup())
+			self.wakeup.clear()
+			self.evaluateAmbient()
+			self.evaluateSchedule()
 
-			if self.hourOn is not None and self.hourOff is not None:
-				if self.hourOn > self.hourOff:
-					stateBegin = self.hourOff
-					stateEnd = self.hourOn
-					stateMode = True
-				else:
-					stateBegin = self.hourOn
-					stateEnd = self.hourOff
-					stateMode = False
+	def evaluateSchedule(self):
+		if self.hourOn is not None and self.hourOff is not None:
+			if self.hourOn > self.hourOff:
+				stateBegin = self.hourOff
+				stateEnd = self.hourOn
+				stateMode = True
+			else:
+				stateBegin = self.hourOn
+				stateEnd = self.hourOff
+				stateMode = False
 
-				previouslyOff = self.scheduleOff
-				hour = int(time.strftime('%H'))
-				if hour >= stateBegin and hour < stateEnd:
-					self.scheduleOff = stateMode
-				else:
-					self.scheduleOff = not stateMode
+			previouslyOff = self.scheduleOff
+			hour = time.localtime(self.clock.time()).tm_hour
+			if hour >= stateBegin and hour < stateEnd:
+				self.scheduleOff = stateMode
+			else:
+				self.scheduleOff = not stateMode
 
-				if self.scheduleOff != previouslyOff:
-					logging.debug('Schedule has triggered change in power %s' % repr(self.scheduleOff))
-					self.evaluatePower()
+			if self.scheduleOff != previouslyOff:
+				logging.debug('Schedule has triggered change in power %s' % repr(self.scheduleOff))
+				self.evaluatePower()
@@ -0,0 +1,87 @@
+# This file is part of photoframe (https://github.com/mrworf/photoframe).
+#
+# photoframe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# photoframe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with photoframe.  If not, see <http://www.gnu.org/licenses/>.
+#
+import math
+import threading
+import logging
+from collections import deque
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+# Keeps the last N durations of each stage in the presentation pipeline
+# so we can tell where the time goes. The high water mark of our own
+# resident memory (in bytes) after preparing each item is kept the same
+# way, as MEMORY. ImageMagick runs in processes of its own and isn't
+# part of it.
+class timing:
+  STAGES = ['select', 'fetch', 'decode', 'identify', 'reframe', 'colour', 'convert', 'write', 'total']
+  MEMORY = 'rss'
+
+  def __init__(self, size=100):
+    self.lock = threading.Lock()
+    self.samples = {}
+    for stage in timing.STAGES + [timing.MEMORY]:
+      self.samples[stage] = deque(maxlen=size)
+
+  @staticmethod
+  def resetPeak():
+    # Linux 4.0 and later can restart the high water mark of resident
+    # memory, otherwise the peak is the highest since we started
+    try:
+      with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+    except:
+      logging.debug('Unable to reset peak memory use')
+
+  @staticmethod
+  def getPeak():
+    # High water mark of resident memory in bytes for this process as a
+    # whole, since the last resetPeak() where supported. Tools we run
+    # aren't counted, the kernel never resets their peak.
+    if resource is None:
+      return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+  def record(self, stage, duration):
+    with self.lock:
+      if stage not in self.samples:
+        self.samples[stage] = deque(maxlen=self.samples['total'].maxlen)
+      self.samples[stage].append(duration)
+
+  def _percentile(self, values, percent):
+    # Nearest-rank, values must be sorted
+    index = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[max(0, min(index, len(values) - 1))]
+
+  def getStatistics(self):
+    result = {}
+    with self.lock:
+      for stage in self.samples:
+        values = list(self.samples[stage])
+        if len(values) == 0:
+          result[stage] = {'count' : 0, 'last' : None, 'p50' : None, 'p95' : None, 'max' : None}
+          continue
+        ordered = sorted(values)
+        result[stage] = {
+          'count' : len(values),
+          'last' : values[-1],
+          'p50' : self._percentile(ordered, 50),
+          'p95' : self._percentile(ordered, 95),
+          'max' : ordered[-1]
+        }
+    return result
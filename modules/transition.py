@@ -0,0 +1,133 @@
+# This file is part of photoframe (https://github.com/mrworf/photoframe).
+#
+# photoframe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# photoframe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with photoframe.  If not, see <http://www.gnu.org/licenses/>.
+#
+import logging
+import time
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# Animates the change from one frame to the next. Works directly on the
+# framebuffer data (any of the 16, 24 or 32bit layouts) so no extra
+# conversion is needed. Steps are timed against the clock, so a slow
+# device simply shows fewer of them, and if it can't even manage a few
+# the transition is skipped.
+class transition:
+  MODES = ['none', 'crossfade', 'wipe']
+
+  # Skip transitions unless we can show at least this many steps
+  MIN_STEPS = 3
+
+  def __init__(self):
+    self.mode = 'none'
+    self.duration = 1.0
+    self.fps = 15
+    # Moving average of seconds needed per step, including the write
+    self.blit = None
+
+  @staticmethod
+  def available():
+    return numpy is not None
+
+  def setConfiguration(self, mode, duration, fps):
+    if mode not in transition.MODES:
+      logging.warning('Unknown transition "%s", not using any', mode)
+      mode = 'none'
+    if mode != 'none' and not transition.available():
+      logging.warning('NumPy is not installed, cannot do transitions')
+      mode = 'none'
+    self.mode = mode
+    self.duration = max(0.0, float(duration))
+    self.fps = max(1, int(fps))
+    self.blit = None
+
+  def isEnabled(self):
+    return self.mode != 'none' and self.duration > 0
+
+  def run(self, old, new, depth, linelength, write, limit=None):
+    # Writes the intermediate steps from old to new using write(), the
+    # caller is responsible for writing the final frame. Never takes
+    # more than limit seconds.
+    duration = self.duration
+    if limit is not None:
+      duration = min(duration, limit)
+    if len(old) != len(new) or duration <= 0:
+      return
+    if self.blit is not None and self.blit * transition.MIN_STEPS > duration:
+      logging.debug('Transition skipped, each step takes %.3fs', self.blit)
+      return
+
+    if self.mode == 'crossfade':
+      step = self._crossfade(old, new, depth, linelength)
+    else:
+      step = self._wipe(old, new, depth, linelength)
+
+    interval = 1.0 / self.fps
+    start = time.time()
+    while True:
+      begin = time.time()
+      position = (begin - start) / duration
+      if position >= 1.0:
+        break
+      write(step(position))
+      spent = time.time() - begin
+      if self.blit is None:
+        self.blit = spent
+      else:
+        self.blit = self.blit * 0.8 + spent * 0.2
+      time.sleep(max(0, interval - spent))
+
+  def _crossfade(self, old, new, depth, linelength):
+    # Integer blend, old + (new - old) * weight / 128, per channel. The
+    # weight is kept at 7 bits so everything fits in 16bit arithmetic.
+    if depth == 16:
+      return self._crossfade565(old, new)
+    base = numpy.frombuffer(old, dtype=numpy.uint8).astype(numpy.int16)
+    delta = numpy.frombuffer(new, dtype=numpy.uint8).astype(numpy.int16) - base
+    def step(position):
+      weight = int(position * 128)
+      return (base + ((delta * weight) >> 7)).astype(numpy.uint8)
+    return step
+
+  def _crossfade565(self, old, new):
+    old = numpy.frombuffer(old, dtype=numpy.uint16).astype(numpy.int32)
+    new = numpy.frombuffer(new, dtype=numpy.uint16).astype(numpy.int32)
+    channels = []
+    for shift, mask in [(11, 0x1F), (5, 0x3F), (0, 0x1F)]:
+      base = (old >> shift) & mask
+      channels.append((shift, base, ((new >> shift) & mask) - base))
+    def step(position):
+      weight = int(position * 256)
+      result = numpy.zeros(old.shape, dtype=numpy.int32)
+      for shift, base, delta in channels:
+        result |= (base + ((delta * weight) >> 8)) << shift
+      return result.astype(numpy.uint16).view(numpy.uint8)
+    return step
+
+  def _wipe(self, old, new, depth, linelength):
+    # Reveals the new frame from left to right
+    pixel = 2 if depth == 16 else depth // 8
+    width = linelength // pixel
+    current = numpy.frombuffer(old, dtype=numpy.uint8).reshape(-1, linelength).copy()
+    target = numpy.frombuffer(new, dtype=numpy.uint8).reshape(-1, linelength)
+    state = {'column' : 0}
+    def step(position):
+      column = int(position * width) * pixel
+      current[:, state['column']:column] = target[:, state['column']:column]
+      state['column'] = column
+      return current.reshape(-1)
+    return step
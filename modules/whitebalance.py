@@ -0,0 +1,146 @@
+# This file is part of photoframe (https://github.com/mrworf/photoframe).
+#
+# photoframe is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# photoframe is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with photoframe.  If not, see <http://www.gnu.org/licenses/>.
+#
+import math
+import threading
+from collections import OrderedDict
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# Makes images look like they are lit by light of a given color
+# temperature, replacing the external colortemp script. Each channel is
+# scaled by how a black body at that temperature compares to daylight.
+# Since the temperature is quantised by colormatch, the lookup tables for
+# each temperature are built once and kept for as long as they're used.
+#
+# Pillow images are adjusted with Image.point(), prepared frames (as made
+# by the ImageMagick renderer) with NumPy.
+class whitebalance:
+  # Temperature which leaves images untouched
+  NEUTRAL = 6500
+
+  # Outside this the black body approximation isn't valid
+  LOWEST = 1000
+  HIGHEST = 40000
+
+  # How many temperatures to keep tables for
+  TABLES = 8
+
+  _tables = OrderedDict()
+  _lock = threading.Lock()
+
+  @staticmethod
+  def available():
+    # Only needed for frames, images just need Pillow
+    return numpy is not None
+
+  @staticmethod
+  def _kelvinToRGB(temperature):
+    # Approximate color of a black body at temperature, see
+    # http://www.tannerhelland.com/4435/convert-temperature-rgb-algorithm-code/
+    t = temperature / 100.0
+    if t <= 66:
+      r = 255.0
+      g = 99.4708025861 * math.log(t) - 161.1195681661
+    else:
+      r = 329.698727446 * math.pow(t - 60, -0.1332047592)
+      g = 288.1221695283 * math.pow(t - 60, -0.0755148492)
+    if t >= 66:
+      b = 255.0
+    elif t <= 19:
+      b = 0.0
+    else:
+      b = 138.5177312231 * math.log(t - 10) - 305.0447927307
+    return [min(255.0, max(0.0, x)) for x in [r, g, b]]
+
+  @staticmethod
+  def getGains(temperature):
+    # Per channel multipliers which make white look like it does under
+    # light of the given temperature
+    temperature = min(whitebalance.HIGHEST, max(whitebalance.LOWEST, temperature))
+    neutral = whitebalance._kelvinToRGB(whitebalance.NEUTRAL)
+    return [x / y for x, y in zip(whitebalance._kelvinToRGB(temperature), neutral)]
+
+  @staticmethod
+  def _getTables(temperature):
+    # Returns the cached tables for temperature, least recently used
+    # temperatures are dropped
+    with whitebalance._lock:
+      if temperature in whitebalance._tables:
+        tables = whitebalance._tables.pop(temperature)
+      else:
+        tables = {'curves' : []}
+        for gain in whitebalance.getGains(temperature):
+          tables['curves'].append([min(255, int(v * gain + 0.5)) for v in range(256)])
+        while len(whitebalance._tables) >= whitebalance.TABLES:
+          whitebalance._tables.popitem(last=False)
+      whitebalance._tables[temperature] = tables
+      return tables
+
+  @staticmethod
+  def getTable(temperature):
+    # 768 entry table (red, green, blue) for Image.point()
+    tables = whitebalance._getTables(temperature)
+    if 'point' not in tables:
+      tables['point'] = tables['curves'][0] + tables['curves'][1] + tables['curves'][2]
+    return tables['point']
+
+  @staticmethod
+  def _getArrays(temperature):
+    tables = whitebalance._getTables(temperature)
+    if 'arrays' not in tables:
+      tables['arrays'] = [numpy.array(x, dtype=numpy.uint8) for x in tables['curves']]
+    return tables['arrays']
+
+  @staticmethod
+  def _get565(temperature, format):
+    # Maps every 16bit value to its adjusted value, so 16bit frames take
+    # a single lookup per pixel. The first channel of format is in the
+    # top 5 bits, like RGB565 for "rgb".
+    tables = whitebalance._getTables(temperature)
+    name = '565' + format[:3]
+    if name not in tables:
+      arrays = whitebalance._getArrays(temperature)
+      high, middle, low = [arrays['rgb'.index(x)] for x in format[:3]]
+      pixels = numpy.arange(65536, dtype=numpy.uint32)
+      first = high[((pixels >> 11) & 0x1F) * 255 // 31].astype(numpy.uint16)
+      second = middle[((pixels >> 5) & 0x3F) * 255 // 63].astype(numpy.uint16)
+      third = low[(pixels & 0x1F) * 255 // 31].astype(numpy.uint16)
+      tables[name] = ((first >> 3) << 11) | ((second >> 2) << 5) | (third >> 3)
+    return tables[name]
+
+  @staticmethod
+  def adjustImage(image, temperature):
+    # Adjusts an RGB Pillow image
+    return image.point(whitebalance.getTable(temperature))
+
+  @staticmethod
+  def adjustFrame(data, format, depth, temperature):
+    # Adjusts raw framebuffer data, format gives the order of the channels
+    # (see display) and depth is 16, 24 or 32
+    if depth == 16:
+      pixels = numpy.frombuffer(data, dtype=numpy.uint16)
+      return whitebalance._get565(temperature, format)[pixels].tobytes()
+
+    arrays = whitebalance._getArrays(temperature)
+    pixels = numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, depth // 8)
+    result = pixels.copy()
+    for index, channel in enumerate(format[:3]):
+      curve = arrays['rgb'.index(channel)]
+      result[:, index] = curve[pixels[:, index]]
+    return result.tobytes()
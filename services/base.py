@@ -309,7 +309,7 @@ class BaseService:
 
   ###[ Actual hard work ]###########################
 
-  def prepareNextItem(self, destinationFile, supportedMimeTypes, displaySize):
+  def prepareNextItem(self, destinationFile, supportedMimeTypes, displaySize, isCached=None):
     # This call requires the service to download the next item it
     # would like to show. The destinationFile has to be used as where to save it
     # and you are only allowed to provide content listed in the supportedMimeTypes.
@@ -320,6 +320,14 @@ class BaseService:
     #  "error" : None or a human readable text string as to why you failed
     #  "source" : Link to where the item came from or None if not provided
     #
+    # The following fields are OPTIONAL:
+    #  "id" : Unique and stable id of the item, allows photoframe to cache it
+    #  "cached" : True if the item wasn't downloaded since photoframe has it (see below)
+    #
+    # If isCached isn't None, it's a function which takes an item id and returns
+    # True if photoframe already has the item. In that case, skip the download
+    # and return with "cached" set to True.
+    #
     # NOTE! If you need to index anything before you can get the first item, this would
     # also be the place to do it.
     result = {'mimetype' : None, 'error' : 'You haven\'t implemented this yet', 'source':None}
@@ -139,8 +139,8 @@ class GooglePhotos(BaseService):
       self.setExtras(extras)
     return result
 
-  def prepareNextItem(self, destinationFile, supportedMimeTypes, displaySize):
-    result = self.fetchImage(destinationFile, supportedMimeTypes, displaySize)
+  def prepareNextItem(self, destinationFile, supportedMimeTypes, displaySize, isCached=None):
+    result = self.fetchImage(destinationFile, supportedMimeTypes, displaySize, isCached)
     if result['error'] is not None:
       # If we end up here, two things can have happened
       # 1. All images have been shown
@@ -149,10 +149,10 @@ class GooglePhotos(BaseService):
       self.memoryForget()
       for file in os.listdir(self.getStoragePath()):
         os.unlink(os.path.join(self.getStoragePath(), file))
-      result = self.fetchImage(destinationFile, supportedMimeTypes, displaySize)
+      result = self.fetchImage(destinationFile, supportedMimeTypes, displaySize, isCached)
     return result
 
-  def fetchImage(self, destinationFile, supportedMimeTypes, displaySize):
+  def fetchImage(self, destinationFile, supportedMimeTypes, displaySize, isCached=None):
     # First, pick which keyword to use
     keywordList = list(self.getKeywords())
     offset = 0
@@ -171,12 +171,14 @@ class GooglePhotos(BaseService):
       if images is None:
         continue
 
-      mimeType, imageUrl, sourceUrl = self.getUrlFromImages(supportedMimeTypes, displaySize, images)
+      mimeType, imageUrl, sourceUrl, itemId = self.getUrlFromImages(supportedMimeTypes, displaySize, images)
       if imageUrl is None:
         continue
+      if isCached is not None and isCached(itemId):
+        return {'mimetype' : mimeType, 'error' : None, 'source': sourceUrl, 'id' : itemId, 'cached' : True}
       result = self.requestUrl(imageUrl, destination=destinationFile)
       if result['status'] == 200:
-        return {'mimetype' : mimeType, 'error' : None, 'source': sourceUrl}
+        return {'mimetype' : mimeType, 'error' : None, 'source': sourceUrl, 'id' : itemId}
 
     # Don't assume spelling by default, make sure API is enabled first!
     if not self.isGooglePhotosEnabled():
@@ -232,11 +234,11 @@ class GooglePhotos(BaseService):
           width = ow
           height = oh
 
-        return entry['mimeType'], entry['baseUrl'] + "=w" + str(width) + "-h" + str(height), entry['productUrl']
+        return entry['mimeType'], entry['baseUrl'] + "=w" + str(width) + "-h" + str(height), entry['productUrl'], entry['id']
       else:
         logging.warning('Unsupported media: %s' % (entry['mimeType']))
       entry = None
-    return None, None, None
+    return None, None, None, None
 
   def getQueryForKeyword(self, keyword):
     result = None
@@ -56,8 +56,8 @@ class PicasaWeb(BaseService):
     keywords = keys[index]
     return 'https://photos.google.com/search/' + keywords
 
-  def prepareNextItem(self, destinationFile, supportedMimeTypes, displaySize):
-    result = self.fetchImage(destinationFile, supportedMimeTypes, displaySize)
+  def prepareNextItem(self, destinationFile, supportedMimeTypes, displaySize, isCached=None):
+    result = self.fetchImage(destinationFile, supportedMimeTypes, displaySize, isCached)
     if result['error'] is not None:
       # If we end up here, two things can have happened
       # 1. All images have been shown
@@ -66,10 +66,10 @@ class PicasaWeb(BaseService):
       self.memoryForget()
       for file in os.listdir(self.getStoragePath()):
         os.unlink(os.path.join(self.getStoragePath(), file))
-      result = self.fetchImage(destinationFile, supportedMimeTypes, displaySize)
+      result = self.fetchImage(destinationFile, supportedMimeTypes, displaySize, isCached)
     return result
 
-  def fetchImage(self, destinationFile, supportedMimeTypes, displaySize):
+  def fetchImage(self, destinationFile, supportedMimeTypes, displaySize, isCached=None):
     # First, pick which keyword to use
     keywordList = list(self.getKeywords())
     offset = 0
@@ -88,12 +88,14 @@ class PicasaWeb(BaseService):
       if images is None:
         continue
 
-      mimeType, imageUrl = self.getUrlFromImages(supportedMimeTypes, displaySize['width'], images)
+      mimeType, imageUrl, itemId = self.getUrlFromImages(supportedMimeTypes, displaySize['width'], images)
       if imageUrl is None:
         continue
+      if isCached is not None and isCached(itemId):
+        return {'mimetype' : mimeType, 'error' : None, 'source':None, 'id' : itemId, 'cached' : True}
       result = self.requestUrl(imageUrl, destination=destinationFile)
       if result['status'] == 200:
-        return {'mimetype' : mimeType, 'error' : None, 'source':None}
+        return {'mimetype' : mimeType, 'error' : None, 'source':None, 'id' : itemId}
     return {'mimetype' : None, 'error' : 'Could not download images from Google Photos', 'source':None}
 
   def getUrlFromImages(self, types, width, images):
@@ -110,13 +112,13 @@ class PicasaWeb(BaseService):
       entry = images['feed']['entry'][index]
       # Make sure we don't get a video, unsupported for now (gif is usually bad too)
       if entry['content']['type'] in types and 'gphoto$videostatus' not in entry:
-        return entry['content']['type'], entry['content']['src'].replace('/s1600/', '/s%d/' % width, 1)
+        return entry['content']['type'], entry['content']['src'].replace('/s1600/', '/s%d/' % width, 1), proposed
       elif 'gphoto$videostatus' in entry:
         logging.debug('Image is thumbnail for videofile')
       else:
         logging.warning('Unsupported media: %s (video = %s)' % (entry['content']['type'], repr('gphoto$videostatus' in entry)))
       entry = None
-    return None, None
+    return None, None, None
 
   def getImagesFor(self, keyword):
     images = None
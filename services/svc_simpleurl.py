@@ -28,7 +28,8 @@ class SimpleUrl(BaseService):
     return 'Each item is a URL that should return a single image. The URL may contain the terms "{width}" and/or "{height}" which will be replaced by numbers describing the size of the display.'
 
 
-  def prepareNextItem(self, destinationFile, supportedMimeTypes, displaySize):
+  def prepareNextItem(self, destinationFile, supportedMimeTypes, displaySize, isCached=None):
+    # URLs usually return different content each time, so nothing is cacheable
     urlList = list(self.getKeywords())
     if len(urlList) == 0:
       return {'mimetype' : None, 'error' : 'No URLs have been specified', 'source': None}
@@ -37,9 +37,21 @@ function rebootWatch() {
   $(document.body).html('<h1>Rebooting</h1>')
 }
 
+var screenTag = null;
 function reloadScreen() {
-  $('#screen').attr('src', "/details/current?" + new Date().getTime())
-  setTimeout(reloadScreen, 10000);
+  // Only fetch the screen again when it has changed
+  $.ajax({
+    url:'/details/current?w=480',
+    type:'HEAD'
+  }).done(function(data, status, xhr) {
+    var tag = xhr.getResponseHeader('ETag');
+    if (tag == null || tag != screenTag) {
+      screenTag = tag;
+      $('#screen').attr('src', "/details/current?w=480&t=" + encodeURIComponent(tag));
+    }
+  }).always(function() {
+    setTimeout(reloadScreen, 10000);
+  });
 }
 reloadScreen();
 
@@ -99,17 +111,20 @@ $("select[name=imagesizing]").change(function() {
 });
 
 $("select[name=orientation]").change(function() {
-  var value = $(this).val()
   $.ajax({
     url:"/setting/" + $(this).attr('name') + "/" + encodeURIComponent($(this).val()),
     type:"PUT"
   }).done(function(){
-    if (value != "both" && confirm("Changing display orientation requires a reboot! Do you want to reboot now?")) {
-      $.ajax({
-        url:"/maintenance/reboot"
-      });
-      rebootWatch();
-    }
+    // Portrait and landscape also rotate the display
+    location.reload();
+  });
+});
+
+$("select[name=rotation]").change(function() {
+  $.ajax({
+    url:"/setting/" + $(this).attr('name') + "/" + encodeURIComponent($(this).val()),
+    type:"PUT"
+  }).done(function(){
   });
 });
 